@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks of the hot paths of lxc-ui.py without real containers.
+Stand-in lxc and _lxc modules are put in front of the real ones and N synthetic containers with
+generated rootfs trees are created in a scratch directory. Rendering and key to frame latency are
+measured on a pseudo terminal. Results are written as JSON, --compare prints the change against
+the results of another version.
+"""
+
+import argparse
+import fcntl
+import importlib.util
+import json
+import os
+import platform
+import pty
+import select
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import termios
+import time
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LXC_UI = os.path.join(HERE, 'lxc-ui.py')
+SCREEN = (50, 200)
+
+FAKE_LXC = '''
+import os
+
+default_config_path = os.environ['LXC_UI_BENCH_LXCPATH']
+LXC_CLONE_SNAPSHOT = 2
+
+
+def attach_run_command(*args):
+    return 0
+
+
+class ContainerNetworkList(list):
+    def __init__(self, container):
+        super(ContainerNetworkList, self).__init__()
+
+
+class Container(object):
+    def __init__(self, name, config_path=None):
+        self.name = name
+        self.config_path = config_path or default_config_path
+        self.config_file_name = os.path.join(self.config_path, name, 'config')
+        self.network = []
+
+    def _state_file(self):
+        return os.path.join(self.config_path, self.name, 'state')
+
+    def _set_state(self, state):
+        with open(self._state_file(), 'w') as fp:
+            fp.write(state)
+        return True
+
+    @property
+    def defined(self):
+        return os.path.exists(self.config_file_name)
+
+    @property
+    def state(self):
+        try:
+            with open(self._state_file()) as fp:
+                return fp.read().strip()
+        except OSError:
+            return 'STOPPED'
+
+    @property
+    def running(self):
+        return self.state != 'STOPPED'
+
+    @property
+    def init_pid(self):
+        return -1
+
+    def get_config_path(self):
+        return self.config_path
+
+    def get_config_item(self, key):
+        values = []
+        with open(self.config_file_name) as fp:
+            for line in fp:
+                if '=' in line and line.split('=')[0].strip() == key:
+                    values.append(line.split('=', 1)[1].strip())
+        if key == 'lxc.group':
+            return values
+        return values[-1] if values else ''
+
+    def get_ips(self, *args, **kwargs):
+        return ()
+
+    def get_cgroup_item(self, key):
+        return ''
+
+    def start(self, *args):
+        return self._set_state('RUNNING')
+
+    def stop(self):
+        return self._set_state('STOPPED')
+
+    def freeze(self):
+        return self._set_state('FROZEN')
+
+    def unfreeze(self):
+        return self._set_state('RUNNING')
+
+    def wait(self, state, timeout=-1):
+        return self.state == state
+
+    def snapshot_list(self):
+        return ()
+'''
+
+FAKE__LXC = '''
+import os
+import lxc
+
+
+def list_containers(active=True, defined=True, config_path=None):
+    path = config_path or lxc.default_config_path
+    return tuple(sorted(os.listdir(path))) if os.path.isdir(path) else ()
+'''
+
+RELEASES = [('Ubuntu 14.04', 'trusty'), ('Ubuntu 16.04', 'xenial'), ('Debian 8', 'jessie')]
+
+
+def make_tree(top, depth, fanout, files, seed):
+    os.makedirs(top, exist_ok=True)
+    for index in range(files):
+        with open(os.path.join(top, 'file%d' % index), 'wb') as fp:
+            fp.truncate((seed * 7919 + index * 104729) % 65536)
+    if depth:
+        for index in range(fanout):
+            make_tree(os.path.join(top, 'dir%d' % index), depth - 1, fanout, files, seed + index)
+
+
+def make_host(root, containers, depth, fanout, files):
+    """Scratch HOME with the stand-in modules, an lxcpath of synthetic containers and a template cache."""
+    fake = os.path.join(root, 'fake')
+    os.makedirs(fake)
+    with open(os.path.join(fake, 'lxc.py'), 'w') as fp:
+        fp.write(FAKE_LXC)
+    with open(os.path.join(fake, '_lxc.py'), 'w') as fp:
+        fp.write(FAKE__LXC)
+    lxcpath = os.path.join(root, 'lxc')
+    for number in range(containers):
+        name = 'bench%04d' % number
+        with_dir = os.path.join(lxcpath, name)
+        os.makedirs(with_dir)
+        with open(os.path.join(with_dir, 'config'), 'w') as fp:
+            fp.write('lxc.utsname = %s\nlxc.start.auto = %d\nlxc.start.order = %d\n' %
+                     (name, number % 2, number % 4))
+        rootfs = os.path.join(with_dir, 'rootfs')
+        make_tree(os.path.join(rootfs, 'usr'), depth, fanout, files, number)
+        os.makedirs(os.path.join(rootfs, 'etc'))
+        description, codename = RELEASES[number % len(RELEASES)]
+        with open(os.path.join(rootfs, 'etc', 'lsb-release'), 'w') as fp:
+            fp.write('DISTRIB_DESCRIPTION="%s"\nDISTRIB_CODENAME=%s\n' % (description, codename))
+    for dist, release in [('ubuntu', 'trusty'), ('ubuntu', 'xenial'), ('debian', 'jessie')]:
+        for arch in ('amd64', 'i386'):
+            image = os.path.join(root, '.cache', 'lxc', 'download', dist, release, arch, 'default')
+            os.makedirs(image)
+            for filename, content in [('build_id', '20170123_03:49\n'), ('rootfs.tar.xz', 'x' * 4096),
+                                      ('meta.tar.xz', 'x' * 512)]:
+                with open(os.path.join(image, filename), 'w') as fp:
+                    fp.write(content)
+    make_tree(os.path.join(root, '.cache', 'lxc', 'download', 'ubuntu', 'trusty', 'amd64', 'default', 'rootfs'),
+              depth, fanout, files, 0)
+    return fake, lxcpath
+
+
+def bench_env(root, fake, lxcpath):
+    env = dict(os.environ, HOME=root, LXC_UI_BENCH_LXCPATH=lxcpath, TERM='xterm',
+               LINES=str(SCREEN[0]), COLUMNS=str(SCREEN[1]))
+    env['PYTHONPATH'] = os.pathsep.join([fake] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    return env
+
+
+def load_lxc_ui(fake):
+    sys.path.insert(0, fake)
+    spec = importlib.util.spec_from_file_location('lxc_ui', LXC_UI)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['lxc_ui'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def summary(samples):
+    samples = sorted(samples)
+    return {'runs': len(samples),
+            'min': samples[0],
+            'median': samples[len(samples) // 2],
+            'p95': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+            'max': samples[-1]}
+
+
+def timed(func, runs, setup=None):
+    samples = []
+    for run in range(runs):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return summary(samples)
+
+
+def bench_functions(ui, root, runs):
+    """The hot paths called in-process, times in milliseconds."""
+    results = {}
+    registry = ui.ContainerRegistry()
+
+    def list_all():
+        nonlocal registry
+        registry = ui.ContainerRegistry()
+        registry.sync()
+        registry.poll(60)
+    results['list_containers'] = timed(list_all, runs)
+
+    def first_rows():
+        startup = ui.ContainerRegistry(budget=0.03)
+        startup.sync()
+        while len(startup) < min(40, len(registry)):
+            startup.poll(60)
+    results['list_first_rows'] = timed(first_rows, runs)
+    containers = list(registry.containers)
+    rootfs = containers[0].rootfs_path()
+    caches = []
+
+    def fresh_cache():
+        caches.append(ui.SizeCache(tempfile.mkdtemp(dir=root)))
+
+    def scan(batch):
+        ui.size_cache = caches[-1]
+        for fu in batch:
+            ui.size_scanner.submit(fu)
+        while any(ui.size_scanner.busy(fu) for fu in batch):
+            ui.size_scanner.poll(timeout=0.5)
+    results['size_scan_one_cold'] = timed(lambda: scan(containers[:1]), runs, fresh_cache)
+    results['size_scan_one_warm'] = timed(lambda: scan(containers[:1]), runs)
+    results['size_scan_all_cold'] = timed(lambda: scan(containers), max(1, runs // 5), fresh_cache)
+    results['size_scan_all_warm'] = timed(lambda: scan(containers), max(1, runs // 5))
+    results['usage_tree'] = timed(lambda: ui.UsageTrees(caches[-1]).get(rootfs), runs)
+    ui.size_scanner.cancel_all()
+    index_files = []
+
+    def fresh_index():
+        index_files.append(os.path.join(tempfile.mkdtemp(dir=root), 'templates.json'))
+
+    def catalog():
+        ui.TemplateCatalog(index_file=index_files[-1]).templates()
+    results['template_catalog_cold'] = timed(catalog, runs, fresh_index)
+    results['template_catalog_warm'] = timed(catalog, runs)
+    results['get_release_info'] = timed(lambda: [ui.get_release_info(fu.etc_path()) for fu in containers], runs)
+    release_cache = ui.ReleaseCache()
+    results['release_cache'] = timed(lambda: [release_cache.get(fu.etc_path()) for fu in containers], runs)
+    for fu in containers:
+        fu.release = release_cache.get(fu.etc_path())
+        registry.refresh(fu)
+
+    def type_filter():
+        for length in range(1, len('bench0042 trusty') + 1):
+            registry.set_filter('bench0042 trusty'[:length])
+        registry.set_filter('')
+    results['filter_keystrokes'] = timed(type_filter, runs)
+    results['sort_toggle'] = timed(lambda: [registry.set_sort(key) for key in ('size', 'state', 'release', 'name')],
+                                   runs)
+    return results
+
+
+def render_child(result_file, fake, runs):
+    """Runs on the pseudo terminal: the main list drawn the way the main loop draws it."""
+    import curses
+    import curses.panel
+    ui = load_lxc_ui(fake)
+    registry = ui.ContainerRegistry()
+    registry.sync()
+    registry.poll(60)
+    scr_id = ui.init_curses()
+    try:
+        size_y, size_x = scr_id.getmaxyx()
+        lxc_win = ui.MenuList(0, 0, size_x, size_y - 11, curses.color_pair(1), curses.color_pair(1), registry.rows,
+                              'LXC list')
+
+        def frame():
+            lxc_win.update()
+            scr_id.noutrefresh()
+            curses.panel.update_panels()
+            curses.doupdate()
+
+        def full():
+            lxc_win.invalidate()
+            frame()
+
+        def one_row():
+            fu = registry[lxc_win.value]
+            fu.marked = not fu.marked
+            registry.refresh(fu)
+            frame()
+
+        pages = iter(range(runs * 2))
+
+        def page():
+            lxc_win.action(338 if next(pages) % 2 == 0 else 339)
+            frame()
+
+        def cursor():
+            lxc_win.action(258)
+            frame()
+        results = {'render_full': timed(full, runs), 'render_one_row': timed(one_row, runs),
+                   'render_page': timed(page, runs), 'render_cursor': timed(cursor, runs)}
+    finally:
+        ui.shutdown_curses(scr_id)
+    with open(result_file, 'w') as fp:
+        json.dump(results, fp)
+
+
+def spawn_on_pty(argv, env):
+    pid, fd = pty.fork()
+    if pid == 0:
+        os.execvpe(argv[0], argv, env)
+    fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack('HHHH', SCREEN[0], SCREEN[1], 0, 0))
+    return pid, fd
+
+
+def drain(fd, quiet):
+    """Reads until nothing arrived for quiet seconds, returns False when the terminal was closed."""
+    while True:
+        readable, _, _ = select.select([fd], [], [], quiet)
+        if not readable:
+            return True
+        try:
+            if not os.read(fd, 65536):
+                return False
+        except OSError:
+            return False
+
+
+def bench_render(env, fake, runs, root):
+    result_file = os.path.join(root, 'render.json')
+    pid, fd = spawn_on_pty([sys.executable, os.path.abspath(__file__), '--render-child', result_file,
+                            '--fake', fake, '--runs', str(runs)], env)
+    while drain(fd, 1.0):
+        if os.waitpid(pid, os.WNOHANG)[0]:
+            break
+    os.close(fd)
+    try:
+        os.waitpid(pid, 0)
+    except ChildProcessError:
+        pass
+    with open(result_file) as fp:
+        return json.load(fp)
+
+
+def bench_key_to_frame(env, runs):
+    """Time from writing the Down key to the terminal until the first byte of the new frame arrives."""
+    pid, fd = spawn_on_pty([sys.executable, LXC_UI], env)
+    drain(fd, 1.5)
+    samples = []
+    for run in range(runs):
+        os.write(fd, b'\x1bOB' if run % 2 == 0 else b'\x1bOA')
+        started = time.perf_counter()
+        select.select([fd], [], [], 5)
+        samples.append((time.perf_counter() - started) * 1000)
+        drain(fd, 0.2)
+    os.write(fd, b'q')
+    drain(fd, 0.5)
+    os.close(fd)
+    try:
+        os.waitpid(pid, 0)
+    except ChildProcessError:
+        pass
+    return {'key_to_frame': summary(samples)}
+
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=HERE,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_file, new):
+    with open(old_file) as fp:
+        old = json.load(fp)
+    if old.get('params') != new['params']:
+        print('parameters differ: %s against %s' % (old.get('params'), new['params']))
+    print('%-22s %12s %12s %8s' % ('median ms', old.get('git') or old_file, new.get('git') or 'now', 'change'))
+    for name, result in sorted(new['results'].items()):
+        before = old['results'].get(name)
+        if not before:
+            print('%-22s %12s %12.3f' % (name, '-', result['median']))
+            continue
+        change = (result['median'] - before['median']) * 100 / before['median'] if before['median'] else 0
+        print('%-22s %12.3f %12.3f %+7.1f%%' % (name, before['median'], result['median'], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark lxc-ui.py against synthetic containers')
+    parser.add_argument('--containers', type=int, default=200)
+    parser.add_argument('--depth', type=int, default=2, help='directory levels below rootfs/usr')
+    parser.add_argument('--fanout', type=int, default=4, help='subdirectories per directory')
+    parser.add_argument('--files', type=int, default=8, help='files per directory')
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--output', default=os.path.join(os.path.expanduser('~'), '.cache', 'lxc-ui', 'bench.json'),
+                        help='where the results are written (default: ~/.cache/lxc-ui/bench.json)')
+    parser.add_argument('--compare', metavar='FILE', help='results of an earlier run to compare with')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directory')
+    parser.add_argument('--render-child', help=argparse.SUPPRESS)
+    parser.add_argument('--fake', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.render_child:
+        render_child(args.render_child, args.fake, args.runs)
+        return
+    root = tempfile.mkdtemp(prefix='lxc-ui-bench-')
+    try:
+        fake, lxcpath = make_host(root, args.containers, args.depth, args.fanout, args.files)
+        env = bench_env(root, fake, lxcpath)
+        os.environ.update(HOME=root, LXC_UI_BENCH_LXCPATH=lxcpath)
+        ui = load_lxc_ui(fake)
+        results = bench_functions(ui, root, args.runs)
+        results.update(bench_render(env, fake, args.runs, root))
+        results.update(bench_key_to_frame(env, args.runs))
+    finally:
+        if args.keep:
+            print('scratch directory: %s' % root)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+    report = {'version': ui.__version__, 'git': git_version(), 'python': platform.python_version(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'params': {'containers': args.containers, 'depth': args.depth, 'fanout': args.fanout,
+                         'files': args.files, 'runs': args.runs},
+              'results': results}
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as fp:
+        json.dump(report, fp, indent=2, sort_keys=True)
+    for name, result in sorted(results.items()):
+        print('%-22s median %9.3f ms  p95 %9.3f ms' % (name, result['median'], result['p95']))
+    if args.compare:
+        compare(args.compare, report)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,71 +12,1679 @@ __status__ = "Release Candidate"
 import curses
 import curses.panel
 import os
+import stat
+import bisect
+import hashlib
+import json
+import argparse
+import queue
+import signal
+import sys
+import time
+import threading
+import ctypes
+import struct
+import select
+import contextlib
+import socket
+from collections import deque
 import lxc
 import _lxc
-import multiprocessing as mp
-import configparser
-from io import StringIO
-import subprocess
+
+SIZE_SUFFIXES = ['B', 'K', 'M', 'G', 'T']
+
+
+def human_size(size):
+    for suffix in SIZE_SUFFIXES:
+        if size < 1024 or suffix == SIZE_SUFFIXES[-1]:
+            return '%.1f%s' % (float(size), suffix)
+        size /= 1024
+
+
+class Profiler:
+    """Call counts and recent durations per operation, every event also goes to the log file when one is set."""
+    def __init__(self, history=200):
+        self.history = history
+        self.stats = {}
+        self.log = None
+
+    def open_log(self, path):
+        self.log = open(path, 'a', buffering=1)
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = self.stats[name] = [0, deque(maxlen=self.history)]
+        stat[0] += 1
+        stat[1].append(seconds)
+        if self.log:
+            self.log.write('%.6f\t%s\t%.3f\n' % (time.time(), name, seconds * 1000))
+
+    def report(self):
+        """(name, calls, last ms, p95 ms) for every operation measured so far."""
+        rows = []
+        for name, (calls, durations) in sorted(self.stats.items()):
+            ordered = sorted(durations)
+            rows.append((name, calls, durations[-1] * 1000,
+                         ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000))
+        return rows
+
+
+profiler = Profiler()
+
+
+class TreeScan:
+    """
+    Result of a rootfs walk, hardlinks are kept by (dev, ino) so partial scans merge without counting them twice.
+    dirs entries are [st_ino, st_mtime_ns, own apparent, own allocated, subdir names, hardlinks].
+    """
+    def __init__(self):
+        self.apparent = 0
+        self.allocated = 0
+        self.hardlinks = {}
+        self.pending = []
+        self.dirs = {}
+        self.dev = None
+
+    def merge(self, other):
+        self.apparent += other.apparent
+        self.allocated += other.allocated
+        self.hardlinks.update(other.hardlinks)
+        self.dirs.update(other.dirs)
+        return self
+
+    def totals(self):
+        apparent, allocated = self.apparent, self.allocated
+        for size, blocks in self.hardlinks.values():
+            apparent += size
+            allocated += blocks
+        return apparent, allocated
+
+
+def scan_tree(top, root_dev=None, split_depth=None):
+    """One lstat per entry, mount points are not crossed. Directories below split_depth go to TreeScan.pending."""
+    result = TreeScan()
+    try:
+        top_st = os.lstat(top)
+    except OSError:
+        return result
+    if root_dev is None:
+        root_dev = top_st.st_dev
+    result.dev = root_dev
+    stack = [(top, 0, top_st)]
+    while stack:
+        path, depth, dir_st = stack.pop()
+        try:
+            entries = os.scandir(path)
+        except OSError:
+            continue
+        dir_entry = [dir_st.st_ino, dir_st.st_mtime_ns, 0, 0, [], []]
+        subdirs = []
+        with entries:
+            for entry in entries:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    if st.st_dev == root_dev:
+                        dir_entry[4].append(entry.name)
+                        subdirs.append((entry.path, st))
+                elif stat.S_ISREG(st.st_mode):
+                    if st.st_nlink > 1:
+                        dir_entry[5].append([st.st_dev, st.st_ino, st.st_size, st.st_blocks * 512])
+                    else:
+                        dir_entry[2] += st.st_size
+                        dir_entry[3] += st.st_blocks * 512
+        result.dirs[path] = dir_entry
+        result.apparent += dir_entry[2]
+        result.allocated += dir_entry[3]
+        for dev, ino, size, blocks in dir_entry[5]:
+            result.hardlinks[(dev, ino)] = (size, blocks)
+        for sub_path, sub_st in subdirs:
+            if split_depth is None or depth < split_depth:
+                stack.append((sub_path, depth + 1, sub_st))
+            else:
+                result.pending.append(sub_path)
+    return result
+
+
+class SizeCache:
+    """Per-directory sizes of every scanned tree, one file per tree, and an index of the rootfs totals."""
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser('~'), '.cache', 'lxc-ui', 'size')
+        self.index_file = os.path.join(self.cache_dir, 'totals.json')
+        self._totals = None
+        self._totals_mtime = None
+
+    def _tree_file(self, path, suffix='json'):
+        return os.path.join(self.cache_dir, '%s.%s' % (hashlib.sha1(path.encode()).hexdigest(), suffix))
+
+    def _write(self, filename, data):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open('%s.%s' % (filename, os.getpid()), 'w') as fp:
+                json.dump(data, fp)
+            os.replace('%s.%s' % (filename, os.getpid()), filename)
+        except OSError:
+            pass
+
+    def load(self, path):
+        try:
+            with open(self._tree_file(path)) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, path, dirs):
+        """Left alone when no directory of the tree changed since the previous save."""
+        digest = hashlib.sha1(repr(sorted((dir_path, entry[:4], entry[5])
+                                          for dir_path, entry in dirs.items())).encode()).hexdigest()
+        try:
+            with open(self._tree_file(path, 'sum')) as fp:
+                if json.load(fp) == digest and os.path.exists(self._tree_file(path)):
+                    return
+        except (OSError, ValueError):
+            pass
+        self._write(self._tree_file(path), dirs)
+        self._write(self._tree_file(path, 'sum'), digest)
+
+    def _index_mtime(self):
+        try:
+            return os.stat(self.index_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def totals(self):
+        """Read again whenever another process, e.g. the daemon, has written the index."""
+        mtime = self._index_mtime()
+        if self._totals is None or mtime != self._totals_mtime:
+            self._totals_mtime = mtime
+            try:
+                with open(self.index_file) as fp:
+                    self._totals = json.load(fp)
+            except (OSError, ValueError):
+                self._totals = {}
+        return self._totals
+
+    def get_total(self, path):
+        return self.totals().get(path)
+
+    def set_total(self, path, totals):
+        self.totals()[path] = list(totals)
+        self._write(self.index_file, self.totals())
+        self._totals_mtime = self._index_mtime()
+
+
+size_cache = SizeCache()
+
+
+def scan_top(path, cache=None):
+    """Walk the two upper levels of a rootfs, the subtrees below them are left in TreeScan.pending."""
+    result = scan_tree(path, split_depth=1)
+    if cache:
+        cache.save(path, result.dirs)
+    result.dirs = {}
+    return result
+
+
+def scan_subtree(path, root_dev, cache=None):
+    result = scan_tree(path, root_dev)
+    if cache:
+        cache.save(path, result.dirs)
+    result.dirs = {}
+    return result
+
+
+class UsageTree:
+    """
+    Directory i is names[i] below parent[i], its children are children[first[i]:first[i] + count[i]], largest first.
+    own[i] is the size of the files directly in it, total[i] includes everything below it.
+    """
+    def __init__(self, root, dirs):
+        from array import array
+        self.root = root
+        self.names = []
+        self.parent = array('l')
+        self.own = array('q')
+        self.own_allocated = array('q')
+        self.complete = True
+        seen = set()
+        stack = [(root, -1)]
+        while stack:
+            path, parent = stack.pop()
+            entry = dirs.get(path)
+            index = len(self.names)
+            self.names.append(os.path.basename(path) if parent >= 0 else path)
+            self.parent.append(parent)
+            if entry is None:
+                self.complete = False
+                self.own.append(0)
+                self.own_allocated.append(0)
+                continue
+            own, own_allocated = entry[2], entry[3]
+            for dev, ino, size, blocks in entry[5]:
+                if (dev, ino) not in seen:
+                    seen.add((dev, ino))
+                    own += size
+                    own_allocated += blocks
+            self.own.append(own)
+            self.own_allocated.append(own_allocated)
+            stack.extend((os.path.join(path, name), index) for name in entry[4])
+        self.total = array('q', self.own)
+        self.allocated = array('q', self.own_allocated)
+        for index in range(len(self.names) - 1, 0, -1):
+            self.total[self.parent[index]] += self.total[index]
+            self.allocated[self.parent[index]] += self.allocated[index]
+        kids = [[] for name in self.names]
+        for index in range(1, len(self.names)):
+            kids[self.parent[index]].append(index)
+        self.children = array('l')
+        self.first = array('l')
+        self.count = array('l')
+        for index, indexes in enumerate(kids):
+            self.first.append(len(self.children))
+            self.count.append(len(indexes))
+            self.children.extend(sorted(indexes, key=lambda kid: self.total[kid], reverse=True))
+
+    def __len__(self):
+        return len(self.names)
+
+    def subdirs(self, index):
+        return self.children[self.first[index]:self.first[index] + self.count[index]]
+
+    def path(self, index):
+        parts = []
+        while index > 0:
+            parts.append(self.names[index])
+            index = self.parent[index]
+        return os.path.join(self.root, *reversed(parts))
+
+    def totals(self):
+        return self.total[0], self.allocated[0]
+
+
+class UsageTrees:
+    """UsageTree of every rootfs browsed, built from the size cache again only after its total changed."""
+    def __init__(self, cache=size_cache):
+        self.cache = cache
+        self.trees = {}
+
+    def get(self, path):
+        """The tree of path, None while it was never scanned."""
+        total = self.cache.get_total(path)
+        if not total:
+            return None
+        cached = self.trees.get(path)
+        if not cached or cached[0] != total:
+            with profiler.measure('usage_tree'):
+                dirs = self.cache.load(path)
+                for sub_path in [os.path.join(dir_path, name) for dir_path, entry in list(dirs.items())
+                                 for name in entry[4]]:
+                    if sub_path not in dirs:
+                        dirs.update(self.cache.load(sub_path))
+                cached = self.trees[path] = (list(total), UsageTree(path, dirs))
+        return cached[1]
+
+    def forget(self, path):
+        self.trees.pop(path, None)
+
+
+usage_trees = UsageTrees()
+
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+
+def container_cgroups(name, pid):
+    """Controller name to the cgroup directory of the container, '' is the unified hierarchy."""
+    dirs = {}
+    with open('/proc/%s/cgroup' % pid) as fp:
+        lines = [line.rstrip('\n').split(':', 2) for line in fp]
+    hybrid = len(lines) > 1
+    for hier, controllers, path in lines:
+        parts = path.split('/')
+        for i, part in enumerate(parts):
+            if part == name or part.endswith('.%s' % name):
+                path = '/'.join(parts[:i + 1])
+                break
+        for controller in controllers.split(',') if controllers else ['']:
+            if controller.startswith('name='):
+                continue
+            if controller:
+                base = os.path.join(CGROUP_ROOT, controller)
+            else:
+                base = os.path.join(CGROUP_ROOT, 'unified') if hybrid else CGROUP_ROOT
+            dirs[controller] = base + path
+    return dirs
+
+
+def _read_cgroup_file(dirs, controller, filename):
+    try:
+        with open(os.path.join(dirs[controller], filename)) as fp:
+            return fp.read()
+    except (KeyError, OSError):
+        return None
+
+
+def read_cgroup_stats(dirs):
+    """cpu in nanoseconds, memory, kmem and blkio in bytes, None where a counter is unavailable."""
+    stats = {'cpu': None, 'memory': None, 'kmem': None, 'pids': None, 'blkio': None}
+    raw = _read_cgroup_file(dirs, 'cpuacct', 'cpuacct.usage')
+    if raw:
+        stats['cpu'] = int(raw)
+    else:
+        raw = _read_cgroup_file(dirs, '', 'cpu.stat')
+        for line in (raw or '').splitlines():
+            if line.startswith('usage_usec '):
+                stats['cpu'] = int(line.split()[1]) * 1000
+    raw = _read_cgroup_file(dirs, 'memory', 'memory.usage_in_bytes') or _read_cgroup_file(dirs, '', 'memory.current')
+    if raw:
+        stats['memory'] = int(raw)
+    raw = _read_cgroup_file(dirs, 'memory', 'memory.kmem.usage_in_bytes')
+    if raw:
+        stats['kmem'] = int(raw)
+    raw = _read_cgroup_file(dirs, 'pids', 'pids.current') or _read_cgroup_file(dirs, '', 'pids.current')
+    if raw:
+        stats['pids'] = int(raw)
+    raw = _read_cgroup_file(dirs, 'blkio', 'blkio.throttle.io_service_bytes')
+    if raw:
+        for line in raw.splitlines():
+            if line.startswith('Total '):
+                stats['blkio'] = int(line.split()[1])
+    else:
+        raw = _read_cgroup_file(dirs, '', 'io.stat')
+        if raw is not None:
+            stats['blkio'] = sum(int(field.split('=')[1]) for line in raw.splitlines()
+                                 for field in line.split()[1:] if field.split('=')[0] in ('rbytes', 'wbytes'))
+    return stats
+
+
+def container_info(container):
+    """The same lines lxc-info prints up to the network statistics, without forking lxc-info."""
+    info = [('Name:', container.name), ('State:', container.state)]
+    pid = container.init_pid
+    if pid > 0:
+        info.append(('PID:', str(pid)))
+        container.ips = list(container.get_ips())
+        info.extend(('IP:', ip) for ip in container.ips)
+        try:
+            stats = read_cgroup_stats(container_cgroups(container.name, pid))
+        except OSError:
+            stats = {}
+        if stats.get('cpu') is not None:
+            info.append(('CPU use:', '%.2f seconds' % (stats['cpu'] / 10 ** 9)))
+        for label, counter in ('BlkIO use:', 'blkio'), ('Memory use:', 'memory'), ('KMem use:', 'kmem'):
+            if stats.get(counter) is not None:
+                info.append((label, human_size(stats[counter])))
+    return ['%-15s %s' % line for line in info]
+
+
+class InfoCache:
+    """container_info results kept for ttl seconds per container."""
+    def __init__(self, ttl=2.0):
+        self.ttl = ttl
+        self.entries = {}
+
+    def get(self, container):
+        cached = self.entries.get(container.config_file_name)
+        if not cached or time.time() - cached[0] > self.ttl:
+            with profiler.measure('container_info'):
+                cached = self.entries[container.config_file_name] = (time.time(), container_info(container))
+        return cached[1]
+
+    def forget(self, container):
+        self.entries.pop(container.config_file_name, None)
+
+
+info_cache = InfoCache()
+
+
+SPARK_CHARS = ' .:-=+*#%@'
+
+
+def sparkline(values, width):
+    values = [v for v in values if v is not None][-width:]
+    top = max(values or [0])
+    if not top:
+        return ' ' * (width - len(values)) + SPARK_CHARS[0] * len(values)
+    return ' ' * (width - len(values)) + ''.join(SPARK_CHARS[int(v * (len(SPARK_CHARS) - 1) / top)] for v in values)
+
+
+class MetricsSampler(threading.Thread):
+    """Cgroup counters of the tracked containers every interval seconds, the last history samples each."""
+    def __init__(self, interval=1.0, history=60):
+        super(MetricsSampler, self).__init__(daemon=True)
+        self.interval = interval
+        self.history = history
+        self.lock = threading.Lock()
+        self.targets = {}
+        self.samples = {}
+        self.cgroups = {}
+
+    def track(self, targets):
+        with self.lock:
+            self.targets = dict(targets)
+            for key in list(self.samples):
+                if key not in self.targets:
+                    del self.samples[key]
+        if not self.is_alive():
+            self.start()
+
+    def forget(self, container):
+        with self.lock:
+            self.targets.pop(container.config_file_name, None)
+            self.samples.pop(container.config_file_name, None)
+
+    def run(self):
+        while True:
+            self.sample()
+            time.sleep(self.interval)
+
+    def sample(self):
+        with self.lock:
+            targets = dict(self.targets)
+        for key in [key for key in self.cgroups if key not in targets]:
+            del self.cgroups[key]
+        now = time.time()
+        for key, (name, pid) in targets.items():
+            if self.cgroups.get(key, (None,))[0] != pid:
+                try:
+                    self.cgroups[key] = (pid, container_cgroups(name, pid))
+                except OSError:
+                    continue
+            stats = read_cgroup_stats(self.cgroups[key][1])
+            with self.lock:
+                if key in self.targets:
+                    self.samples.setdefault(key, deque(maxlen=self.history)).append((now, stats))
+
+    def series(self, key):
+        """cpu in percent and blkio in bytes per second between samples, memory and pids as sampled."""
+        with self.lock:
+            samples = list(self.samples.get(key, ()))
+        series = {'cpu': [], 'memory': [], 'pids': [], 'blkio': []}
+        for (t0, s0), (t1, s1) in zip(samples, samples[1:]):
+            for counter, scale in ('cpu', 100 / 10 ** 9), ('blkio', 1):
+                if s0[counter] is None or s1[counter] is None:
+                    series[counter].append(None)
+                else:
+                    series[counter].append(max(s1[counter] - s0[counter], 0) * scale / (t1 - t0))
+            series['memory'].append(s1['memory'])
+            series['pids'].append(s1['pids'])
+        return series
+
+
+metrics_sampler = MetricsSampler()
+
+
+IN_MODIFY = 0x2
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_ISDIR = 0x40000000
+CGROUP_PARENTS = ['lxc', 'lxc.payload']
+CGROUP_PREFIXES = ['lxc.payload.', 'lxc.monitor.']
+STATE_LETTERS = {'RUNNING': 'R', 'STOPPED': 'S', 'FROZEN': 'F', 'FREEZING': 'F', 'THAWED': 'R'}
+
+
+class StateWatcher(threading.Thread):
+    """
+    Container states from inotify on their cgroups and a slow sweep, pushed as (key, state, init pid) to changes.
+    Addresses of running containers go to addresses as (key, ips).
+    """
+    def __init__(self, sweep_interval=10.0, recheck_interval=0.5, address_interval=5.0):
+        super(StateWatcher, self).__init__(daemon=True)
+        self.sweep_interval = sweep_interval
+        self.recheck_interval = recheck_interval
+        self.address_interval = address_interval
+        self.lock = threading.Lock()
+        self.targets = {}
+        self.requested = set()
+        self.changes = queue.Queue()
+        self.addresses = queue.Queue()
+        self.known = {}
+        self.ips = {}
+        self.visible = set()
+        self.containers = {}
+        self.watches = {}
+        self.wake_r, self.wake_w = os.pipe()
+        self.inotify_fd = None
+        try:
+            self.libc = ctypes.CDLL(None, use_errno=True)
+            fd = self.libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+            if fd >= 0:
+                self.inotify_fd = fd
+        except (OSError, AttributeError):
+            pass
+
+    def watch(self, container):
+        with self.lock:
+            self.targets[container.config_file_name] = (container.name, container.get_config_path())
+            self.requested.add(container.config_file_name)
+        self.wakeup()
+        if not self.is_alive():
+            self.start()
+
+    def forget(self, container):
+        with self.lock:
+            self.targets.pop(container.config_file_name, None)
+            self.containers.pop(container.config_file_name, None)
+        self.known.pop(container.config_file_name, None)
+        self.ips.pop(container.config_file_name, None)
+
+    def last_known(self, container):
+        return self.known.get(container.config_file_name, (None, -1))
+
+    def check(self, container):
+        with self.lock:
+            self.requested.add(container.config_file_name)
+        self.wakeup()
+
+    def wakeup(self):
+        os.write(self.wake_w, b'.')
+
+    def _watch(self, path, mask):
+        if self.inotify_fd is None or path in self.watches.values() or not os.path.isdir(path):
+            return
+        wd = self.libc.inotify_add_watch(self.inotify_fd, path.encode(), mask)
+        if wd >= 0:
+            self.watches[wd] = path
+
+    def _watch_cgroup_parents(self):
+        for base in [CGROUP_ROOT, os.path.join(CGROUP_ROOT, 'unified'), os.path.join(CGROUP_ROOT, 'freezer')]:
+            for path in [base] + [os.path.join(base, parent) for parent in CGROUP_PARENTS]:
+                self._watch(path, IN_CREATE | IN_DELETE)
+
+    def _watch_container(self, name, pid):
+        try:
+            dirs = container_cgroups(name, pid)
+        except OSError:
+            return
+        for controller in ('', 'freezer'):
+            if controller in dirs:
+                self._watch(os.path.dirname(dirs[controller]), IN_CREATE | IN_DELETE)
+        if '' in dirs and os.path.exists(os.path.join(dirs[''], 'cgroup.events')):
+            self._watch(dirs[''], IN_MODIFY)
+
+    def _read_events(self):
+        names = set()
+        try:
+            buf = os.read(self.inotify_fd, 65536)
+        except OSError:
+            return names
+        offset = 0
+        while offset + 16 <= len(buf):
+            wd, mask, cookie, length = struct.unpack_from('iIII', buf, offset)
+            name = buf[offset + 16:offset + 16 + length].rstrip(b'\0').decode(errors='replace')
+            offset += 16 + length
+            if mask & IN_MODIFY:
+                name = os.path.basename(self.watches.get(wd, ''))
+            elif mask & IN_CREATE and mask & IN_ISDIR and name in CGROUP_PARENTS:
+                self._watch(os.path.join(self.watches.get(wd, ''), name), IN_CREATE | IN_DELETE)
+                continue
+            for prefix in CGROUP_PREFIXES:
+                if name.startswith(prefix):
+                    name = name[len(prefix):]
+            names.add(name)
+            names.add(name.rsplit('-', 1)[0])
+        return names
+
+    def _query(self, key):
+        with self.lock:
+            target = self.targets.get(key)
+        if not target:
+            return None
+        container = self.containers.get(key)
+        if container is None:
+            container = lxc.Container(*target)
+            with self.lock:
+                if key not in self.targets:
+                    return None
+                self.containers[key] = container
+        state, pid = container.state, container.init_pid
+        if self.known.get(key) != (state, pid):
+            self.known[key] = (state, pid)
+            self.changes.put((key, state, pid))
+            if pid > 0:
+                self._watch_container(target[0], pid)
+            self._query_ips(key)
+        return state
+
+    def _query_ips(self, key):
+        container = self.containers.get(key)
+        if container is None:
+            return
+        ips = list(container.get_ips()) if self.known.get(key, (None, -1))[1] > 0 else []
+        if self.ips.get(key, []) != ips:
+            self.ips[key] = ips
+            self.addresses.put((key, ips))
+
+    def run(self):
+        self._watch_cgroup_parents()
+        last_sweep = last_addresses = 0
+        recheck = set()
+        while True:
+            timeout = max(min(self.sweep_interval - (time.time() - last_sweep),
+                              self.address_interval - (time.time() - last_addresses),
+                              self.recheck_interval if recheck else self.sweep_interval), 0)
+            fds = [self.wake_r] + ([self.inotify_fd] if self.inotify_fd is not None else [])
+            ready = select.select(fds, [], [], timeout)[0]
+            with self.lock:
+                keys = set(self.requested)
+                self.requested.clear()
+                by_name = {}
+                for key, (name, config_path) in self.targets.items():
+                    by_name.setdefault(name, []).append(key)
+            if self.wake_r in ready:
+                os.read(self.wake_r, 4096)
+            if self.inotify_fd in ready:
+                for name in self._read_events():
+                    keys.update(by_name.get(name, []))
+            if time.time() - last_sweep >= self.sweep_interval:
+                keys.update(self.targets)
+                last_sweep = time.time()
+            if not ready:
+                keys.update(recheck)
+                recheck.clear()
+            visible = self.visible
+            for key in sorted(keys, key=lambda key: key not in visible):
+                if self._query(key) in ('STARTING', 'STOPPING', 'ABORTING', 'FREEZING'):
+                    recheck.add(key)
+            if time.time() - last_addresses >= self.address_interval:
+                for key in [key for key, (state, pid) in list(self.known.items()) if pid > 0]:
+                    self._query_ips(key)
+                last_addresses = time.time()
+
+
+state_watcher = StateWatcher()
+
+
+_result_q = None
+
+
+def _init_worker():
+    """Workers inherit the ncurses SIGTERM handler, which would reset the terminal. Ctrl+C belongs to the UI."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def _init_size_worker(result_q):
+    global _result_q
+    _result_q = result_q
+    _init_worker()
+
+
+def _size_task(key, job_id, path, root_dev, cache_dir):
+    """Without root_dev path is a rootfs whose upper levels are walked, otherwise one subtree below them."""
+    try:
+        cache = SizeCache(cache_dir)
+        if root_dev is None:
+            part = scan_top(path, cache)
+            _result_q.put(('top', key, job_id, part.apparent, part.allocated, part.hardlinks, part.dev, part.pending))
+        else:
+            part = scan_subtree(path, root_dev, cache)
+            _result_q.put(('part', key, job_id, part.apparent, part.allocated, part.hardlinks))
+    except Exception:
+        _result_q.put(('error', key, job_id))
+
+
+class SizeJob:
+    def __init__(self, job_id, container):
+        self.job_id = job_id
+        self.container = container
+        self.scan = TreeScan()
+        self.outstanding = None
+        self.failed = False
+        self.started = time.time()
+
+    def add(self, apparent, allocated, hardlinks):
+        self.scan.apparent += apparent
+        self.scan.allocated += allocated
+        self.scan.hardlinks.update(hardlinks)
+
+
+class SizeScanner:
+    """Rootfs scans of all containers in one process pool, poll() returns the containers whose size changed."""
+    def __init__(self, processes=None, max_jobs=2):
+        self.processes = processes
+        self.max_jobs = max_jobs
+        self.pool = None
+        self.result_q = None
+        self.waiting = []
+        self.jobs = {}
+        self.last_job_id = 0
+
+    def _start_pool(self):
+        if self.pool is None:
+            import multiprocessing as mp
+            self.result_q = mp.Queue()
+            self.pool = mp.Pool(self.processes, _init_size_worker, (self.result_q,))
+
+    def submit(self, container, first=False):
+        if not self.busy(container):
+            self.waiting.insert(0 if first else len(self.waiting), container)
+
+    def busy(self, container):
+        return container in self.waiting or container.config_file_name in self.jobs
+
+    def _handle(self, msg):
+        kind, key, job_id = msg[:3]
+        job = self.jobs.get(key)
+        if not job or job.job_id != job_id:
+            return None
+        container = job.container
+        if kind == 'top':
+            apparent, allocated, hardlinks, root_dev, pending = msg[3:]
+            job.add(apparent, allocated, hardlinks)
+            job.outstanding = len(pending)
+            for path in pending:
+                self.pool.apply_async(_size_task, (key, job_id, path, root_dev, size_cache.cache_dir))
+        elif kind == 'part':
+            job.add(*msg[3:])
+            job.outstanding -= 1
+        elif job.outstanding is None:
+            del self.jobs[key]
+            container.rootfs_size = '?'
+            return container
+        else:
+            job.outstanding -= 1
+            job.failed = True
+        apparent, allocated = job.scan.totals()
+        if job.outstanding:
+            container.rootfs_size = '%s~' % human_size(apparent)
+        elif job.failed:
+            del self.jobs[key]
+            container.rootfs_size = '?'
+        else:
+            del self.jobs[key]
+            container.rootfs_size = human_size(apparent)
+            container.rootfs_bytes = apparent
+            container.rootfs_allocated = allocated
+            size_cache.set_total(container.rootfs_path(), (apparent, allocated))
+            profiler.record('size_scan', time.time() - job.started)
+        return container
+
+    def poll(self, timeout=0):
+        changed = []
+        while self.result_q is not None:
+            try:
+                msg = self.result_q.get(timeout=timeout) if timeout and self.jobs and not changed \
+                    else self.result_q.get_nowait()
+            except queue.Empty:
+                break
+            container = self._handle(msg)
+            if container and container not in changed:
+                changed.append(container)
+        while self.waiting and len(self.jobs) < self.max_jobs:
+            self._start_pool()
+            container = self.waiting.pop(0)
+            self.last_job_id += 1
+            self.jobs[container.config_file_name] = SizeJob(self.last_job_id, container)
+            self.pool.apply_async(_size_task, (container.config_file_name, self.last_job_id,
+                                               container.rootfs_path(), None, size_cache.cache_dir))
+        return changed
+
+    def cancel(self, container):
+        if container in self.waiting:
+            self.waiting.remove(container)
+        if container.config_file_name in self.jobs and self.jobs[container.config_file_name].container is container:
+            del self.jobs[container.config_file_name]
+
+    def cancel_all(self):
+        self.waiting.clear()
+        self.jobs.clear()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+size_scanner = SizeScanner()
+
+
+LIFECYCLE_TARGETS = {'start': 'RUNNING', 'stop': 'STOPPED', 'freeze': 'FROZEN', 'unfreeze': 'RUNNING'}
+
+
+def lifecycle_action(key, name, config_path, action, timeout, wait_network=False):
+    """Runs in a pool worker on a container object of its own."""
+    started = time.time()
+    container = lxc.Container(name, config_path)
+    if container.state == LIFECYCLE_TARGETS[action]:
+        return key, name, action, container.state, 0
+    if not getattr(container, action)():
+        return key, name, action, 'FAILED', time.time() - started
+    if not container.wait(LIFECYCLE_TARGETS[action], timeout):
+        return key, name, action, 'TIMEOUT', time.time() - started
+    if wait_network:
+        while not container.get_ips() and time.time() - started < timeout:
+            time.sleep(0.2)
+        if not container.get_ips():
+            return key, name, action, 'NO NETWORK', time.time() - started
+    return key, name, action, 'OK', time.time() - started
+
+
+def _lifecycle_action(args):
+    return lifecycle_action(*args)
+
+
+def result_line(name, action, result, elapsed):
+    return '%-40s %-9s %-10s %.1fs' % (name, action, result, elapsed)
+
+
+class BulkExecutor:
+    """Lifecycle actions on many containers, at most limit of them in flight."""
+    def __init__(self, limit=8, timeout=10):
+        self.limit = limit
+        self.timeout = timeout
+        self.pool = None
+        self.results = queue.Queue()
+        self.pending = 0
+
+    def submit(self, containers, action):
+        if self.pool is None:
+            import multiprocessing as mp
+            self.pool = mp.Pool(self.limit, _init_worker)
+        for fu in containers:
+            self.pending += 1
+            self.pool.apply_async(lifecycle_action,
+                                  (fu.config_file_name, fu.name, fu.get_config_path(), action, self.timeout),
+                                  callback=self.results.put,
+                                  error_callback=lambda error, fu=fu: self.results.put(
+                                      (fu.config_file_name, fu.name, action, 'ERROR', 0)))
+
+    def poll(self):
+        done = []
+        while True:
+            try:
+                done.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+        self.pending -= len(done)
+        return done
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+bulk_executor = BulkExecutor()
+
+
+def _config_int(container, key, default=0):
+    try:
+        return int(''.join(container.get_config_item(key)) or default)
+    except ValueError:
+        return default
+
+
+def boot_plan(containers, groups=None):
+    """Tiers of lxc.start.auto containers by lxc.start.order with their delays, '' in groups stands for no lxc.group."""
+    tiers = {}
+    for fu in containers:
+        if not _config_int(fu, 'lxc.start.auto'):
+            continue
+        fu_groups = [group for group in fu.get_config_item('lxc.group') or [] if group] or ['']
+        if not set(fu_groups) & set(groups or ['']):
+            continue
+        tiers.setdefault(_config_int(fu, 'lxc.start.order'), []).append((fu, _config_int(fu, 'lxc.start.delay')))
+    return sorted(tiers.items(), key=lambda tier: tier[0])
+
+
+def boot_host(tiers, wait_network=False, timeout=30, limit=8, report=None):
+    """Starts the tiers of a boot_plan one after the other, returns the seconds until the last one was up."""
+    started = time.time()
+    report = report or (lambda line, result=None: print(line))
+    if not tiers:
+        report('nothing to boot')
+        return 0
+    import multiprocessing as mp
+    with mp.Pool(limit, _init_worker) as pool:
+        for number, (order, tier) in enumerate(tiers, start=1):
+            report('tier %s/%s: order %s, %s containers' % (number, len(tiers), order, len(tier)))
+            for result in pool.imap_unordered(_lifecycle_action,
+                                              [(fu.config_file_name, fu.name, fu.get_config_path(), 'start',
+                                                timeout, wait_network) for fu, delay in tier]):
+                report(result_line(*result[1:]), result)
+            delay = max(delay for fu, delay in tier)
+            if delay and number < len(tiers):
+                report('waiting %ss' % delay)
+                time.sleep(delay)
+    elapsed = time.time() - started
+    report('host booted in %.1fs' % elapsed)
+    return elapsed
+
+
+def expand_names(pattern):
+    """web{1..20} stands for web1 up to web20, zero padded like the first number. Other names stand for themselves."""
+    start, brace, rest = pattern.partition('{')
+    first, dots, rest = rest.partition('..')
+    last, brace_end, end = rest.partition('}')
+    if not (brace and dots and brace_end and first.isdigit() and last.isdigit()):
+        return [pattern]
+    width = len(first) if first.startswith('0') else 0
+    return ['%s%0*d%s' % (start, width, number, end) for number in range(int(first), int(last) + 1)]
+
+
+FICLONE = 0x40049409
+SNAPSHOT_BACKENDS = ('btrfs', 'zfs', 'lvm', 'overlayfs', 'aufs')
+UTSNAME_KEYS = ('lxc.utsname', 'lxc.uts.name')
+ROOTFS_KEYS = ('lxc.rootfs', 'lxc.rootfs.path', 'lxc.mount', 'lxc.mount.fstab')
+
+
+def mount_fstype(path):
+    """Filesystem type of the mount path lives on."""
+    path = os.path.realpath(path)
+    fstype, longest = None, -1
+    with open('/proc/self/mounts') as mounts:
+        for line in mounts:
+            fields = line.split()
+            mount_point = fields[1].replace('\\040', ' ')
+            if len(mount_point) > longest and \
+                    (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')):
+                fstype, longest = fields[2], len(mount_point)
+    return fstype
+
+
+def _config_str(container, *keys):
+    """The first of keys this liblxc knows and has a value for."""
+    for key in keys:
+        try:
+            value = ''.join(container.get_config_item(key))
+        except KeyError:
+            continue
+        if value:
+            return value
+    return ''
+
+
+def backing_store(container):
+    """Backing store of the rootfs: dir, btrfs, zfs, lvm, overlayfs, aufs, ..."""
+    backend = _config_str(container, 'lxc.rootfs.backend')
+    if backend:
+        return backend
+    rootfs = _config_str(container, 'lxc.rootfs', 'lxc.rootfs.path') or container.rootfs_path()
+    if ':' in rootfs and not rootfs.startswith('/'):
+        return 'overlayfs' if rootfs.split(':')[0] == 'overlay' else rootfs.split(':')[0]
+    if rootfs.startswith('/dev/'):
+        return 'lvm'
+    try:
+        return 'btrfs' if mount_fstype(rootfs) == 'btrfs' else 'dir'
+    except OSError:
+        return 'dir'
+
+
+def reflink_supported(path):
+    """Clones one scratch file into another in path, filesystems without reflinks refuse that."""
+    import fcntl
+    import tempfile
+    try:
+        with tempfile.TemporaryFile(dir=path) as source, tempfile.TemporaryFile(dir=path) as target:
+            source.write(b'.')
+            source.flush()
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        return True
+    except OSError:
+        return False
+
+
+def clone_methods(container):
+    """The ways container can be cloned, a full copy always works."""
+    backing = backing_store(container)
+    methods = ['copy']
+    if backing in SNAPSHOT_BACKENDS:
+        methods.append('snapshot')
+    if backing == 'dir':
+        methods.append('overlay')
+    if backing in ('dir', 'btrfs') and reflink_supported(container.get_config_path()):
+        methods.append('reflink')
+    return methods
+
+
+def random_hwaddr():
+    return '00:16:3e:%02x:%02x:%02x' % tuple(os.urandom(3))
+
+
+def reflink_clone(source, name, config_path):
+    """cp --reflink=always of the container directory, the config gets the new name, paths and MAC addresses."""
+    import shutil
+    import subprocess
+    source_dir = os.path.join(config_path, source)
+    target_dir = os.path.join(config_path, name)
+    if os.path.exists(target_dir):
+        print('%s exists' % target_dir, flush=True)
+        return False
+    try:
+        subprocess.check_call(['cp', '-a', '--reflink=always', source_dir, target_dir])
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(e, flush=True)
+        shutil.rmtree(target_dir, ignore_errors=True)
+        return False
+    config_file = os.path.join(target_dir, 'config')
+    with open(config_file) as fp:
+        lines = fp.readlines()
+    for index, line in enumerate(lines):
+        key, sep, value = line.partition('=')
+        key = key.strip()
+        if not sep or key.startswith('#'):
+            continue
+        if key in UTSNAME_KEYS:
+            lines[index] = '%s = %s\n' % (key, name)
+        elif key in ROOTFS_KEYS:
+            lines[index] = '%s = %s\n' % (key, value.strip().replace(source_dir, target_dir))
+        elif key.endswith('.hwaddr'):
+            lines[index] = '%s = %s\n' % (key, random_hwaddr())
+    with open(config_file, 'w') as fp:
+        fp.writelines(lines)
+    hostname = os.path.join(target_dir, 'rootfs', 'etc', 'hostname')
+    with contextlib.suppress(OSError):
+        with open(hostname) as fp:
+            old_hostname = fp.read().strip()
+        if old_hostname == source:
+            with open(hostname, 'w') as fp:
+                fp.write('%s\n' % name)
+    return True
+
+
+def clone_container(source, name, config_path, method='copy'):
+    """method is copy, snapshot, overlay or reflink."""
+    if method == 'reflink':
+        return reflink_clone(source, name, config_path)
+    flags, bdevtype = {'copy': (0, None),
+                       'snapshot': (lxc.LXC_CLONE_SNAPSHOT, None),
+                       'overlay': (lxc.LXC_CLONE_SNAPSHOT, 'overlayfs')}[method]
+    return lxc.Container(source, config_path).clone(name, config_path=config_path, flags=flags, bdevtype=bdevtype)
+
+
+def free_space(path):
+    try:
+        stats = os.statvfs(path)
+    except OSError:
+        return None
+    return stats.f_bavail * stats.f_frsize
+
+
+def provision(job_id, action, name, config_path, options, log_file):
+    """Runs in a pool worker, everything liblxc and the template print goes to log_file."""
+    started = time.time()
+    log_fd = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    null_fd = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null_fd, 0)
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+    os.close(log_fd)
+    os.close(null_fd)
+    try:
+        print('%s %s' % (action, name), flush=True)
+        if action == 'create':
+            done = lxc.Container(name, config_path).create('download', 0, options)
+        elif action == 'clone':
+            done = clone_container(options['source'], name, config_path, options.get('method', 'copy'))
+        elif action == 'snapshot':
+            done = lxc.Container(name, config_path).snapshot()
+            print(done or 'no snapshot taken', flush=True)
+        elif action == 'restore':
+            done = lxc.Container(name, config_path).snapshot_restore(options['snapshot'])
+        else:
+            container = lxc.Container(name, config_path)
+            done = True
+            for snapshot in options['snapshots']:
+                destroyed = container.snapshot_destroy(snapshot)
+                print('%s %s' % (snapshot, 'destroyed' if destroyed else 'FAILED'), flush=True)
+                done = done and destroyed
+        result = 'OK' if done else 'FAILED'
+    except Exception as e:
+        print('%s: %s' % (type(e).__name__, e), flush=True)
+        result = 'ERROR'
+    sys.stdout.flush()
+    return job_id, result, time.time() - started
+
+
+class ProvisionJob:
+    def __init__(self, job_id, action, name, config_path, log_file):
+        self.job_id = job_id
+        self.action = action
+        self.name = name
+        self.config_path = config_path
+        self.log_file = log_file
+        self.result = None
+        self.started = time.time()
+        self.elapsed = None
+
+    def state(self):
+        if self.result:
+            return self.result
+        return 'running' if os.path.exists(self.log_file) else 'queued'
+
+    def row(self):
+        return '%-8s %-8s %-40s %7.1fs  %s' % (self.state(), self.action, self.name,
+                                               self.elapsed if self.elapsed is not None else time.time() - self.started,
+                                               self.log_file)
+
+    def log_tail(self, lines):
+        try:
+            with open(self.log_file, errors='replace') as fp:
+                return [line.rstrip('\n') for line in deque(fp, lines)]
+        except OSError:
+            return []
+
+
+class ProvisionQueue:
+    """Creates and clones, at most limit of them at once, every job logs to a file under log_dir."""
+    def __init__(self, limit=4, log_dir=None, keep_logs=100):
+        self.limit = limit
+        self.keep_logs = keep_logs
+        self.log_dir = log_dir or os.path.join(os.path.expanduser('~'), '.cache', 'lxc-ui', 'jobs')
+        self.pool = None
+        self.results = queue.Queue()
+        self.jobs = []
+        self.running = {}
+        self.last_job_id = 0
+
+    def submit(self, action, name, config_path, options=None):
+        if self.pool is None:
+            import multiprocessing as mp
+            self.pool = mp.Pool(self.limit, _init_worker)
+            self._prune_logs()
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.last_job_id += 1
+        log_file = os.path.join(self.log_dir, '%d-%d.%s.log' % (os.getpid(), self.last_job_id, action))
+        job = ProvisionJob(self.last_job_id, action, name, config_path, log_file)
+        self.jobs.append(job)
+        self.running[job.job_id] = job
+        self.pool.apply_async(provision, (job.job_id, action, name, config_path, options or {}, log_file),
+                              callback=self.results.put,
+                              error_callback=lambda error, job_id=job.job_id: self.results.put((job_id, 'ERROR', 0)))
+        return job
+
+    def _prune_logs(self):
+        """Only the newest keep_logs logs of earlier sessions are kept."""
+        try:
+            with os.scandir(self.log_dir) as entries:
+                logs = sorted((entry.stat().st_mtime, entry.path) for entry in entries if entry.name.endswith('.log'))
+        except OSError:
+            return
+        for mtime, path in logs[:max(len(logs) - self.keep_logs, 0)]:
+            with contextlib.suppress(OSError):
+                os.unlink(path)
+
+    @property
+    def pending(self):
+        return len(self.running)
+
+    def poll(self):
+        done = []
+        while True:
+            try:
+                job_id, result, elapsed = self.results.get_nowait()
+            except queue.Empty:
+                break
+            job = self.running.pop(job_id, None)
+            if job:
+                job.result, job.elapsed = result, elapsed
+                done.append(job)
+        return done
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+provision_queue = ProvisionQueue()
+
+
+class ProvisionBatch:
+    """Jobs of one action, the free space of their lxcpath before and after them tells what clones saved."""
+    def __init__(self, jobs, config_path, source=None):
+        self.jobs = jobs
+        self.config_path = config_path
+        self.source = source
+        self.started = time.time()
+        self.free_before = free_space(config_path)
+
+    def done(self):
+        return all(job.result for job in self.jobs)
+
+    def summary(self):
+        elapsed = time.time() - self.started
+        work = sum(job.elapsed or 0 for job in self.jobs)
+        ok = [job for job in self.jobs if job.result == 'OK']
+        lines = ['%s of %s %s OK%s in %.1fs, %.1fs of work, %.1fs saved by running them in parallel' % (
+            len(ok), len(self.jobs), self.jobs[0].action, ' from %s' % self.source.name if self.source is not None else '',
+            elapsed, work, max(work - elapsed, 0))]
+        source_bytes = self.source.rootfs_allocated or self.source.rootfs_bytes if self.source is not None else None
+        free_after = free_space(self.config_path)
+        if source_bytes and ok and self.free_before is not None and free_after is not None:
+            used = max(self.free_before - free_after, 0)
+            full = source_bytes * len(ok)
+            lines.append('disk: %s used, %s for full copies, %s (%.0f%%) saved' % (
+                human_size(used), human_size(full), human_size(max(full - used, 0)),
+                max(full - used, 0) * 100 / full))
+        return lines
+
 
 class BugContainer(lxc.Container):
     def __init__(self, name, config_path=None):
         super(BugContainer, self).__init__(name, config_path)
         self.my_config = ''
         self.rootfs_size = '...'
-        self.rootfs_q = mp.Queue()
-        self.p = None
-
-    def fork_size_calc(self, win_d=None, position=None):
-        self.p = mp.Process(target=self._get_size, args=(self.config_file_name, self.rootfs_q, win_d, position))
-        self.p.start()
-        self.p.join()
-
-    def _get_size(self, path, val_q, w_d, size_pos):
-        def calc_suffix():
-            nonlocal r
-            r = 0
-            r = int(len(str(total_size))) // 3
-            tsize = total_size / 1024 ** r
-            if tsize < 1:
-                tsize *= 1024
-                r -= 1
-            return tsize
-
-        total_size = 0
-        r = 0
-        if w_d:
-            y, x = w_d.getyx()
-        start_path = path.replace('config', 'rootfs')
-
-        join = os.path.join
-        getsize = os.path.getsize
-        isfile = os.path.isfile
-        islink = os.path.islink
-
-        for tree in os.walk(start_path):
-            for f in tree[2]:
-                fp = join(tree[0], f)
-                if isfile(fp) and not islink(fp):
-                    total_size += getsize(fp)
-                    if w_d and size_pos:
-                        w_d.addstr(size_pos, 5, '%.1f%-4s' % (float(calc_suffix()), ['B', 'K', 'M', 'G', 'T'][r]), curses.A_REVERSE)
-                        w_d.move(y, x)
-                        w_d.refresh()
-        total_size = calc_suffix()
-        val_q.put('%.1f%s' % (float(total_size), ['B', 'K', 'M', 'G', 'T'][r]))
+        self.rootfs_bytes = None
+        self.rootfs_allocated = None
+        last_size = size_cache.get_total(self.rootfs_path())
+        if last_size:
+            self.rootfs_size = human_size(last_size[0])
+            self.rootfs_bytes, self.rootfs_allocated = last_size
+        self.release = None
+        self.known_state = None
+        self.known_pid = -1
+        self.marked = False
+        self.ips = []
+
+    def fork_size_calc(self):
+        size_scanner.submit(self)
+
+    def rootfs_path(self):
+        return os.path.join(os.path.dirname(self.config_file_name), 'rootfs')
+
+    def etc_path(self):
+        return os.path.join(os.path.dirname(self.config_file_name), 'rootfs', 'etc', '')
 
     def get_rootfs_size(self):
-        if not self.rootfs_q.empty():
-            self.rootfs_size = self.rootfs_q.get()
         return self.rootfs_size
 
+    def list_row(self, path_width=0):
+        return '%s[%s] %-8s %-50s %s%s' % ('*' if self.marked else ' ',
+                                           STATE_LETTERS.get(self.known_state, (self.known_state or '?')[0]),
+                                           self.get_rootfs_size(),
+                                           self.name,
+                                           '%-*s ' % (path_width, self.get_config_path()) if path_width else '',
+                                           self.release or '...')
+
+    def search_text(self):
+        return ' '.join([self.name, self.release or ''] + list(self.ips)).lower()
+
     def stop(self):
         super(BugContainer, self).stop()
-        #self.rootfs_size = self._get_size()
         self.fork_size_calc()
 
 
+class Snapshot:
+    """A snapshot directory standing in for a rootfs in SizeScanner."""
+    def __init__(self, name, timestamp, snaps_dir):
+        self.name = name
+        self.timestamp = timestamp
+        self.path = os.path.join(snaps_dir, name)
+        self.config_file_name = os.path.join(self.path, 'config')
+        self.rootfs_size = '...'
+        self.rootfs_bytes = None
+        self.rootfs_allocated = None
+        self.marked = False
+        self.deleting = False
+        last_size = size_cache.get_total(self.path)
+        if last_size:
+            self.rootfs_size = human_size(last_size[0])
+            self.rootfs_bytes, self.rootfs_allocated = last_size
+
+    def rootfs_path(self):
+        return self.path
+
+    def row(self):
+        return '%s%-10s %-19s %8s' % ('-' if self.deleting else '+' if self.marked else ' ', self.name, self.timestamp,
+                                      self.rootfs_size)
+
+
+class SearchIndex:
+    """Trigram index over lower case texts, every term of a query must match."""
+    def __init__(self):
+        self.texts = {}
+        self.grams = {}
+
+    @staticmethod
+    def trigrams(text):
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def update(self, key, text):
+        """Returns False when the text of key did not change."""
+        old = self.texts.get(key)
+        if old == text:
+            return False
+        if old is not None:
+            self.remove(key)
+        self.texts[key] = text
+        for gram in self.trigrams(text):
+            self.grams.setdefault(gram, set()).add(key)
+        return True
+
+    def remove(self, key):
+        for gram in self.trigrams(self.texts.pop(key, '')):
+            keys = self.grams[gram]
+            keys.discard(key)
+            if not keys:
+                del self.grams[gram]
+
+    def _search_term(self, term, keys):
+        if len(term) < 3:
+            return {key for key in (self.texts if keys is None else keys) if term in self.texts[key]}
+        sets = sorted((self.grams.get(gram, set()) for gram in self.trigrams(term)), key=len)
+        found = set(sets[0]) if keys is None else sets[0] & keys
+        for other in sets[1:]:
+            found &= other
+        if len(term) == 3:
+            return found
+        return {key for key in found if term in self.texts[key]}
+
+    def search(self, query):
+        """Keys matching every term of query, None for an empty query."""
+        keys = None
+        for term in sorted(query.lower().split(), key=len, reverse=True):
+            keys = self._search_term(term, keys)
+            if not keys:
+                break
+        return keys
+
+    def matches(self, key, query):
+        text = self.texts.get(key, '')
+        return all(term in text for term in query.lower().split())
+
+
+STATE_ORDER = {'RUNNING': 0, 'FROZEN': 1, 'FREEZING': 1, 'THAWED': 1, 'STARTING': 2, 'STOPPING': 2, 'STOPPED': 3}
+
+SORT_KEYS = {
+    'name': lambda fu: (fu.name, fu.config_file_name),
+    'state': lambda fu: (STATE_ORDER.get(fu.known_state, 4), fu.name, fu.config_file_name),
+    'size': lambda fu: (fu.rootfs_bytes is None, -(fu.rootfs_bytes or 0), fu.name, fu.config_file_name),
+    'release': lambda fu: (fu.release is None, fu.release or '', fu.name, fu.config_file_name),
+}
+
+
+class ContainerRegistry:
+    """
+    BugContainer objects in list order and the rows of the main list, filtered and sorted in place.
+    Every lxcpath is listed by a thread of its own, with an InventoryClient everything comes from the daemon.
+    """
+    def __init__(self, config_paths=None, inventory=None, budget=None, listing_timeout=None):
+        self.inventory = inventory
+        self.budget = budget
+        self.listing_timeout = listing_timeout
+        self.config_paths = [os.path.normpath(path or lxc.default_config_path) for path in config_paths or [None]]
+        self.path_width = max(len(path) for path in self.config_paths) if len(self.config_paths) > 1 else 0
+        self.listing = set()
+        self.listed = queue.Queue()
+        self.deadlines = {}
+        self.stalled = set()
+        self.pending = deque()
+        self.sort_by = 'name'
+        self.sort_keys = {}
+        self.order = []
+        self.containers = []
+        self.lines = []
+        self.view = []
+        self.view_order = []
+        self.rows = []
+        self.by_key = {}
+        self.by_name = {}
+        self.search = SearchIndex()
+        self.query = ''
+
+    def __len__(self):
+        return len(self.view)
+
+    def __getitem__(self, index):
+        return self.view[index]
+
+    def __iter__(self):
+        return iter(self.view)
+
+    def __contains__(self, container):
+        return self.by_key.get(container.config_file_name) is container
+
+    def index(self, container):
+        """Position of container in the filtered list or None."""
+        index = bisect.bisect_left(self.view_order, self.sort_keys[container.config_file_name])
+        if index < len(self.view) and self.view[index] is container:
+            return index
+        return None
+
+    def _show(self, fu, line):
+        key = self.sort_keys[fu.config_file_name]
+        index = bisect.bisect_left(self.view_order, key)
+        self.view.insert(index, fu)
+        self.view_order.insert(index, key)
+        self.rows.insert(index, line)
+
+    def _hide(self, index):
+        del self.view[index], self.view_order[index], self.rows[index]
+
+    def _put(self, fu, line, visible):
+        key = self.sort_keys[fu.config_file_name]
+        index = bisect.bisect_left(self.order, key)
+        self.order.insert(index, key)
+        self.containers.insert(index, fu)
+        self.lines.insert(index, line)
+        if visible:
+            self._show(fu, line)
+
+    def _take(self, fu):
+        index = bisect.bisect_left(self.order, self.sort_keys[fu.config_file_name])
+        del self.order[index], self.containers[index], self.lines[index]
+        view_index = self.index(fu)
+        if view_index is not None:
+            self._hide(view_index)
+
+    def set_filter(self, query):
+        """A query extending the previous one narrows the current view."""
+        if query.lower().split() == self.query.lower().split():
+            self.query = query
+            return
+        if self.query and query.lower().startswith(self.query.lower()) and query.strip():
+            keep = [index for index, fu in enumerate(self.view) if self.search.matches(fu.config_file_name, query)]
+            self.view[:] = [self.view[index] for index in keep]
+            self.view_order[:] = [self.view_order[index] for index in keep]
+            self.rows[:] = [self.rows[index] for index in keep]
+            self.query = query
+            return
+        self.query = query
+        keys = self.search.search(query)
+        if keys is None:
+            positions = range(len(self.containers))
+        else:
+            positions = sorted(bisect.bisect_left(self.order, self.sort_keys[key]) for key in keys)
+        self._show_positions(positions)
+
+    def _show_positions(self, positions):
+        self.view[:] = [self.containers[index] for index in positions]
+        self.view_order[:] = [self.order[index] for index in positions]
+        self.rows[:] = [self.lines[index] for index in positions]
+
+    def set_sort(self, sort_by):
+        """The only place the whole list is sorted, it runs once per change of the order."""
+        if sort_by == self.sort_by:
+            return
+        self.sort_by = sort_by
+        visible = {fu.config_file_name for fu in self.view}
+        for fu in self.containers:
+            self.sort_keys[fu.config_file_name] = SORT_KEYS[sort_by](fu)
+        entries = sorted(zip(self.containers, self.lines), key=lambda entry: self.sort_keys[entry[0].config_file_name])
+        self.containers[:] = [fu for fu, line in entries]
+        self.lines[:] = [line for fu, line in entries]
+        self.order[:] = [self.sort_keys[fu.config_file_name] for fu in self.containers]
+        self._show_positions([index for index, fu in enumerate(self.containers) if fu.config_file_name in visible])
+
+    def find(self, key):
+        return self.by_key.get(key)
+
+    def sync(self):
+        """Starts listing every lxcpath that is not being listed already."""
+        if self.inventory:
+            self.listing.add('snapshot')
+            self.inventory.send('sync')
+            self.inventory.send('snapshot')
+            return
+        paths = [path for path in self.config_paths if path not in self.listing and path not in self.stalled]
+        self.listing.update(paths)
+        for path in paths:
+            self.deadlines[path] = time.time() + self.listing_timeout if self.listing_timeout else float('inf')
+        list_lxcpaths(paths, self.listed)
+
+    def busy(self):
+        return bool(self.listing or self.pending)
+
+    def poll(self, timeout=0):
+        """Merges finished listings and adds the next batch, True when containers were added or removed."""
+        if self.inventory:
+            changed = self._poll_inventory(timeout)
+            return self._add_pending() or changed
+        deadline = time.time() + timeout
+        changed = False
+        while self.listing or self.stalled:
+            self._expire()
+            wait = min([deadline] + [self.deadlines[path] for path in self.listing]) - time.time() \
+                if timeout and self.listing else 0
+            try:
+                path, names = self.listed.get(timeout=wait) if wait > 0 else self.listed.get_nowait()
+            except queue.Empty:
+                if wait > 0 and time.time() < deadline:
+                    continue
+                break
+            self.listing.discard(path)
+            self.stalled.discard(path)
+            self.deadlines.pop(path, None)
+            if isinstance(names, Exception):
+                continue
+            names = set(names)
+            known = {name for known_path, name in self.by_name if known_path == path}
+            for name in known - names:
+                self.remove(name, path)
+                changed = True
+            self.pending.extend((self.add, (name, path)) for name in sorted(names - known))
+        return self._add_pending() or changed
+
+    def _expire(self):
+        now = time.time()
+        for path in [path for path in self.listing if self.deadlines[path] <= now]:
+            self.listing.discard(path)
+            self.stalled.add(path)
+
+    def _add_pending(self):
+        """Works through the queued additions until the budget of this poll is spent."""
+        deadline = time.time() + self.budget if self.budget else None
+        changed = bool(self.pending)
+        while self.pending:
+            add, args = self.pending.popleft()
+            add(*args)
+            if deadline and time.time() >= deadline:
+                break
+        return changed
+
+    def announce(self):
+        """Lets the daemon list again after containers were created, renamed or destroyed here."""
+        if self.inventory:
+            self.inventory.send('sync')
+
+    def _poll_inventory(self, timeout=0):
+        deadline = time.time() + timeout
+        changed = False
+        while True:
+            try:
+                event = self.inventory.events.get(timeout=max(deadline - time.time(), 0)) \
+                    if timeout and self.listing else self.inventory.events.get_nowait()
+            except queue.Empty:
+                break
+            if event['event'] == 'snapshot':
+                self.listing.discard('snapshot')
+                paths = {record['path'] for record in event['records']} | set(self.config_paths)
+                self.path_width = max(len(path) for path in paths) if len(paths) > 1 else 0
+                keys = {record['key'] for record in event['records']}
+                for fu in [fu for key, fu in self.by_key.items() if key not in keys]:
+                    self.remove(fu.name, fu.get_config_path())
+                    changed = True
+                for record in sorted(event['records'], key=lambda record: record['name']):
+                    if record['key'] in self.by_key:
+                        changed = self._apply(record) or changed
+                    else:
+                        self.pending.append((self._apply, (record,)))
+            elif event['event'] == 'update':
+                changed = self._apply(event['record']) or changed
+            elif event['event'] == 'remove' and event['key'] in self.by_key:
+                fu = self.by_key[event['key']]
+                self.remove(fu.name, fu.get_config_path())
+                changed = True
+            elif event['event'] == 'closed':
+                self.listing.clear()
+        return changed
+
+    def _apply(self, record):
+        """Takes over a record of the daemon, returns True when the container was new."""
+        fu = self.by_key.get(record['key'])
+        added = fu is None
+        if added:
+            fu = self.add(record['name'], record['path'])
+            if fu is None:
+                return False
+        fu.release, fu.ips = record['release'], record['ips']
+        fu.rootfs_bytes, fu.rootfs_size, fu.rootfs_allocated = record['size'], record['size_text'], record['allocated']
+        if (fu.known_state, fu.known_pid) != (record['state'], record['pid']):
+            state_watcher.changes.put((fu.config_file_name, record['state'], record['pid']))
+            info_cache.forget(fu)
+        self.refresh(fu)
+        return added
+
+    def add(self, name, config_path=None):
+        config_path = os.path.normpath(config_path) if config_path else self.config_paths[0]
+        if (config_path, name) in self.by_name:
+            return None
+        fu = BugContainer(name, config_path)
+        if not fu.defined:
+            return None
+        fu.known_state, fu.known_pid = state_watcher.last_known(fu)
+        self.by_key[fu.config_file_name] = fu
+        self.by_name[config_path, name] = fu
+        self.sort_keys[fu.config_file_name] = SORT_KEYS[self.sort_by](fu)
+        self.search.update(fu.config_file_name, fu.search_text())
+        self._put(fu, fu.list_row(self.path_width), self.search.matches(fu.config_file_name, self.query))
+        state_watcher.watch(fu)
+        return fu
+
+    def remove(self, name, config_path=None):
+        config_path = os.path.normpath(config_path) if config_path else self.config_paths[0]
+        fu = self.by_name.get((config_path, name))
+        if fu is None:
+            return
+        self._take(fu)
+        del self.by_key[fu.config_file_name], self.by_name[config_path, name], self.sort_keys[fu.config_file_name]
+        self.search.remove(fu.config_file_name)
+        state_watcher.forget(fu)
+        metrics_sampler.forget(fu)
+        size_scanner.cancel(fu)
+        info_cache.forget(fu)
+        usage_trees.forget(fu.rootfs_path())
+
+    def refresh(self, fu):
+        if fu not in self:
+            return
+        line = fu.list_row(self.path_width)
+        key = SORT_KEYS[self.sort_by](fu)
+        view_index = self.index(fu)
+        visible = view_index is not None
+        if self.search.update(fu.config_file_name, fu.search_text()) and self.query:
+            visible = self.search.matches(fu.config_file_name, self.query)
+        if key != self.sort_keys[fu.config_file_name] or visible != (view_index is not None):
+            self._take(fu)
+            self.sort_keys[fu.config_file_name] = key
+            self._put(fu, line, visible)
+            return
+        self.lines[bisect.bisect_left(self.order, key)] = line
+        if visible:
+            self.rows[view_index] = line
+
+
 class Interface:
     def __init__(self, y, x, w, h, title_color, regular_text_color, title=''):
         curses.init_pair(80, curses.COLOR_YELLOW, curses.COLOR_BLACK)
@@ -158,7 +1766,7 @@ class EditBar(Interface):
         if (len(self.value) < self.w - 3 and ((48 <= special_key <= 57) or
                                               (65 <= special_key <= 90) or
                                               (97 <= special_key <= 122) or
-                                              special_key in (45, 95, 58, 47, 44, 46, 64, 32))):
+                                              special_key in (45, 95, 58, 47, 44, 46, 64, 32, 123, 125))):
             if self.numeric and not chr(special_key).isdigit():
                 return
             self.value.insert(self.cursor_position_x - 1, chr(special_key))
@@ -177,6 +1785,7 @@ class List(Interface):
         self.pages = round(len(self.rlist) / self.y_max) - 1
         self.cursor_pos = 1
         self.value = 0
+        self.drawn = {}
         self.print_rlist()
         self.win_id.move(1, 1)
 
@@ -185,6 +1794,7 @@ class List(Interface):
         curses.curs_set(0)
 
     def _find_position(self):
+        self.pages = (len(self.rlist) - 1) // self.y_max
         self.page = int(self.value / self.y_max)
         self.cursor_pos = self.value - (self.page * self.y_max) + 1
 
@@ -192,14 +1802,35 @@ class List(Interface):
         self._find_position()
         self.print_rlist()
 
-    def print_rlist(self, check=''):
-        for pos, fu in enumerate(self.rlist[self.page * self.y_max:(self.page * self.y_max) + self.y_max]):
-            self.win_id.move(1 + pos if pos < self.y_max else self.y_max, 1)
-            self.win_id.clrtobot()
-            self.win_id.addstr(1 + pos if pos < self.y_max else self.y_max, 1, '%s%s' % (check, fu))
+    def invalidate(self):
+        self.drawn.clear()
         self.win_id.box()
         self.print_title()
 
+    def row_attr(self, row):
+        return 0
+
+    def set_title(self, title):
+        self.title = title
+        self.win_id.box()
+        self.print_title()
+
+    def print_rlist(self, check=''):
+        """
+        Only rows that changed since they were drawn are written, call invalidate() after painting over the window.
+        """
+        first = self.page * self.y_max
+        for row in range(1, self.y_max + 1):
+            index = first + row - 1
+            text = '%s%s' % (check, self.rlist[index]) if index < len(self.rlist) else ''
+            text = text[:self.w - 2].ljust(self.w - 2)
+            attr = self.row_attr(row)
+            if self.drawn.get(row) != (text, attr):
+                self.win_id.addstr(row, 1, text)
+                if attr:
+                    self.win_id.chgat(row, 1, self.w - 2, attr)
+                self.drawn[row] = (text, attr)
+
     def action(self, special_key):
         super(List, self).action(special_key)
 
@@ -251,23 +1882,22 @@ class List(Interface):
 
 
 class MenuList(List):
+    """Does not refresh on every call, the main loop does one doupdate per frame."""
     def __init__(self, x, y, w, h, title_color, regular_text_color, rlist, title=''):
         super(MenuList, self).__init__(x, y, w, h, title_color, regular_text_color, rlist, title)
+        self.win_id.immedok(False)
         self.print_rlist()
 
+    def row_attr(self, row):
+        return curses.A_REVERSE if len(self.rlist) and row == self.cursor_pos else 0
+
     def print_rlist(self, check=''):
         super(MenuList, self).print_rlist()
 
-    def update(self):
-        super(MenuList, self).update()
-        self.action(0)
-        self.win_id.refresh()
-
     def action(self, special_key):
         if len(self.rlist):
-            self.win_id.chgat(self.cursor_pos, 1, self.w - 2, self.regular_text_color)
             super(MenuList, self).action(special_key)
-            self.win_id.chgat(self.cursor_pos, 1, self.w - 2, curses.A_REVERSE)
+            self.print_rlist()
 
     @staticmethod
     def focus():
@@ -282,6 +1912,7 @@ class RadioList(List):
 
     def print_rlist(self, check=''):
         if len(self.rlist) > 0:
+            self.drawn.clear()
             super(RadioList, self).print_rlist('[ ]')
             if self.page * self.y_max <= self.choice <= self.page * self.y_max + self.y_max:
                 self.win_id.addstr(self.choice - self.page * self.y_max, 2, '*', self.regular_text_color)
@@ -412,7 +2043,42 @@ def my_list_containers(active=True, defined=True, as_object=False, config_path=N
         return entries
 
 
+def list_lxcpaths(config_paths, results):
+    """Lists every lxcpath in a daemon thread of its own, (path, names or the exception) go to results."""
+    def run(path):
+        try:
+            results.put((path, my_list_containers(config_path=path)))
+        except Exception as e:
+            results.put((path, e))
+
+    for path in config_paths:
+        threading.Thread(target=run, args=(path,), name='list %s' % path, daemon=True).start()
+
+
+def list_all_containers(config_paths=None, timeout=None):
+    """Containers of every lxcpath, yielded per path as soon as its listing is done."""
+    config_paths = [os.path.normpath(path or lxc.default_config_path) for path in config_paths or [None]]
+    results = queue.Queue()
+    list_lxcpaths(config_paths, results)
+    pending = set(config_paths)
+    deadline = time.time() + timeout if timeout else None
+    while pending:
+        try:
+            path, names = results.get(timeout=max(deadline - time.time(), 0) if deadline else None)
+        except queue.Empty:
+            for path in sorted(pending):
+                sys.stderr.write('%s: not listed within %ss\n' % (path, timeout))
+            return
+        pending.discard(path)
+        if isinstance(names, Exception):
+            sys.stderr.write('%s: %s\n' % (path, names))
+            continue
+        for name in names:
+            yield BugContainer(name, path)
+
+
 def init_curses():
+    os.environ.setdefault('ESCDELAY', '25')
     screen_id = curses.initscr()
     curses.cbreak()
     curses.noecho()
@@ -433,18 +2099,29 @@ def shutdown_curses(scr_id):
     curses.endwin()
 
 
-def get_release_info(path):
+def find_release_file(path):
+    return '%s%s' % (path, [rfile for rfile in next(os.walk(path))[2] if 'release' in rfile][0])
+
+
+def parse_release_file(filename):
+    """configparser is imported on first use, its errors are raised as ValueError."""
+    import configparser
+    from io import StringIO
+
     def add_section(fp):
         content = "[DEFAULT]\n%s" % fp.read()
         return StringIO(content)
 
     def read_releasefile(filename):
         config = configparser.RawConfigParser(allow_no_value=True)
-        config.read_file(add_section(open(filename)))
+        with open(filename) as fp:
+            config.read_file(add_section(fp))
         return config
 
-    pars = read_releasefile('%s%s' % (path,
-                                      [rfile for rfile in next(os.walk(path))[2] if 'release' in rfile][0]))
+    try:
+        pars = read_releasefile(filename)
+    except configparser.Error as e:
+        raise ValueError('%s: %s' % (filename, e))
     for n1, n2 in ['DISTRIB_DESCRIPTION', 'DISTRIB_CODENAME'], ['NAME', 'VERSION']:
         try:
             rel = '%s %s' % (pars['DEFAULT'][n1], pars['DEFAULT'][n2])
@@ -456,23 +2133,617 @@ def get_release_info(path):
     return rel.replace('"', '')
 
 
-def keyboard_shortcuts(scr_id):
+def get_release_info(path):
+    return parse_release_file(find_release_file(path))
+
+
+class ReleaseCache:
+    """Release strings by release file and mtime, shared by every BugContainer."""
+    def __init__(self):
+        self.release_files = {}
+        self.releases = {}
+
+    def _release_file(self, path):
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.release_files.get(path)
+        if not cached or cached[0] != mtime:
+            cached = self.release_files[path] = (mtime, find_release_file(path))
+        return cached[1]
+
+    def get(self, path):
+        try:
+            filename = self._release_file(path)
+            mtime = os.stat(filename).st_mtime_ns
+            cached = self.releases.get(filename)
+            if not cached or cached[0] != mtime:
+                with profiler.measure('get_release_info'):
+                    cached = self.releases[filename] = (mtime, parse_release_file(filename))
+            return cached[1]
+        except (OSError, IndexError, StopIteration, ValueError):
+            return 'unknown'
+
+
+release_cache = ReleaseCache()
+
+
+LIST_FIELDS = ('name', 'state', 'pid', 'ips', 'release', 'size', 'allocated', 'path')
+LIST_DEFAULT_FIELDS = ('name', 'state', 'release', 'size')
+
+
+def write_record(out, record, fields, as_json):
+    if as_json:
+        out.write('%s\n' % json.dumps(record))
+    else:
+        out.write('%s\n' % '\t'.join('' if record[f] is None else
+                                      ','.join(record[f]) if isinstance(record[f], list) else str(record[f])
+                                      for f in fields))
+    out.flush()
+
+
+def inventory_record(fu, fields):
+    """size and allocated are left to the size engine."""
+    record = {}
+    for field in fields:
+        if field == 'name':
+            record[field] = fu.name
+        elif field == 'state':
+            record[field] = fu.state
+        elif field == 'pid':
+            record[field] = fu.init_pid if fu.init_pid > 0 else None
+        elif field == 'ips':
+            record[field] = list(fu.get_ips()) if fu.running else []
+        elif field == 'release':
+            record[field] = release_cache.get(fu.etc_path())
+        elif field == 'path':
+            record[field] = fu.get_config_path()
+        else:
+            record[field] = None
+    return record
+
+
+def list_inventory(containers, fields=LIST_DEFAULT_FIELDS, as_json=False, out=None):
+    """Headless listing, a record is written once it is complete, as JSON lines or tab separated."""
+    out = out or sys.stdout
+
+    def emit(record):
+        write_record(out, record, fields, as_json)
+
+    if 'size' not in fields and 'allocated' not in fields:
+        for fu in containers:
+            emit(inventory_record(fu, fields))
+        return
+    listed = []
+    records = {}
+    scanned = set()
+
+    def collect(timeout=0):
+        scanned.update(fu for fu in size_scanner.poll(timeout=timeout) if not size_scanner.busy(fu))
+        for fu in [fu for fu in scanned if fu in records]:
+            scanned.discard(fu)
+            totals = size_cache.get_total(fu.rootfs_path()) if fu.rootfs_size != '?' else None
+            record = records.pop(fu)
+            if 'size' in fields:
+                record['size'] = totals[0] if totals else None
+            if 'allocated' in fields:
+                record['allocated'] = totals[1] if totals else None
+            emit(record)
+
+    try:
+        for fu in containers:
+            size_scanner.submit(fu)
+            listed.append(fu)
+            collect()
+        for fu in listed:
+            records[fu] = inventory_record(fu, fields)
+            collect()
+        while records:
+            collect(timeout=0.5)
+    finally:
+        size_scanner.cancel_all()
+
+
+DAEMON_SOCKET = os.path.join(os.path.expanduser('~'), '.cache', 'lxc-ui', 'daemon.sock')
+
+
+def daemon_record(fu):
+    """Everything a client shows of a container, keyed like the registry."""
+    return {'key': fu.config_file_name, 'name': fu.name, 'path': os.path.normpath(fu.get_config_path()),
+            'state': fu.known_state, 'pid': fu.known_pid, 'ips': list(fu.ips), 'release': fu.release,
+            'size': fu.rootfs_bytes, 'size_text': fu.rootfs_size, 'allocated': fu.rootfs_allocated}
+
+
+class InventoryDaemon:
+    """
+    Registry, size scanner, state watcher and metrics sampler shared with clients over a unix socket.
+    A client that does not read its events is dropped.
+    """
+    def __init__(self, socket_path=DAEMON_SOCKET, config_paths=None, sync_interval=30.0, max_buffer=1 << 22,
+                 listing_timeout=None):
+        self.socket_path = socket_path
+        self.registry = ContainerRegistry(config_paths, listing_timeout=listing_timeout)
+        self.sync_interval = sync_interval
+        self.max_buffer = max_buffer
+        self.server = None
+        self.clients = {}
+        self.subscribed = set()
+        self.stopped = False
+
+    def _bind(self):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+            raise SystemExit('%s: a daemon is already listening' % self.socket_path)
+        except OSError:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        finally:
+            probe.close()
+        os.makedirs(os.path.dirname(self.socket_path) or '.', exist_ok=True)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_path)
+        self.server.listen(16)
+        self.server.setblocking(False)
+
+    def stop(self, *args):
+        self.stopped = True
+
+    def serve(self):
+        self._bind()
+        signal.signal(signal.SIGTERM, self.stop)
+        self.registry.sync()
+        synced = tracked = time.time()
+        try:
+            while not self.stopped:
+                readable, writable, _ = select.select([self.server] + list(self.clients),
+                                                      [c for c, (i, o) in self.clients.items() if o], [], 0.15)
+                for client in readable:
+                    if client is self.server:
+                        self._accept()
+                    else:
+                        self._serve_client(self._read, client)
+                for client in writable:
+                    if client in self.clients:
+                        self._serve_client(self._write, client)
+                if time.time() - synced > self.sync_interval:
+                    self.registry.sync()
+                    synced = time.time()
+                if time.time() - tracked > 5:
+                    self._refresh_running()
+                    tracked = time.time()
+                self._publish()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.close()
+            os.unlink(self.socket_path)
+            size_scanner.cancel_all()
+
+    def _accept(self):
+        try:
+            client, _ = self.server.accept()
+        except OSError:
+            return
+        client.setblocking(False)
+        self.clients[client] = [b'', b'']
+
+    def _serve_client(self, method, client):
+        try:
+            method(client)
+        except Exception:
+            self._drop(client)
+
+    def _drop(self, client):
+        self.clients.pop(client, None)
+        self.subscribed.discard(client)
+        client.close()
+
+    def _read(self, client):
+        try:
+            data = client.recv(65536)
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(client)
+            return
+        buffers = self.clients[client]
+        buffers[0] += data
+        *lines, buffers[0] = buffers[0].split(b'\n')
+        for line in lines:
+            try:
+                self._handle(client, json.loads(line.decode()))
+            except (ValueError, KeyError, TypeError):
+                continue
+
+    def _write(self, client):
+        buffers = self.clients[client]
+        try:
+            sent = client.send(buffers[1])
+        except OSError:
+            self._drop(client)
+            return
+        buffers[1] = buffers[1][sent:]
+
+    def _send(self, client, message):
+        buffers = self.clients.get(client)
+        if buffers is None:
+            return
+        buffers[1] += ('%s\n' % json.dumps(message)).encode()
+        if len(buffers[1]) > self.max_buffer:
+            self._drop(client)
+
+    def _handle(self, client, request):
+        op = request['op']
+        fu = self.registry.find(request.get('key'))
+        if op == 'snapshot':
+            self.subscribed.add(client)
+            self._send(client, {'event': 'snapshot',
+                                'records': [daemon_record(fu) for fu in self.registry.containers]})
+        elif op == 'sync':
+            self.registry.sync()
+        elif op == 'size' and fu:
+            size_scanner.submit(fu)
+        elif op == 'check' and fu:
+            state_watcher.check(fu)
+        elif op == 'info':
+            self._send(client, {'id': request['id'], 'result': info_cache.get(fu) if fu else None})
+        elif op == 'series':
+            self._send(client, {'id': request['id'], 'result': metrics_sampler.series(request['key'])})
+
+    def _refresh_running(self):
+        running = [fu for fu in self.registry.containers if fu.known_pid > 0]
+        metrics_sampler.track((fu.config_file_name, (fu.name, fu.known_pid)) for fu in running)
+
+    def _broadcast(self, message):
+        for client in list(self.subscribed):
+            self._send(client, message)
+
+    def _publish(self):
+        before = set(self.registry.by_key)
+        changed = set()
+        self.registry.poll()
+        for key in before - set(self.registry.by_key):
+            self._broadcast({'event': 'remove', 'key': key})
+        changed.update(set(self.registry.by_key) - before)
+        while True:
+            try:
+                key, state, pid = state_watcher.changes.get_nowait()
+            except queue.Empty:
+                break
+            fu = self.registry.find(key)
+            if fu:
+                fu.known_state, fu.known_pid = state, pid
+                if pid <= 0:
+                    fu.ips = []
+                info_cache.forget(fu)
+                self.registry.refresh(fu)
+                changed.add(key)
+        while True:
+            try:
+                key, ips = state_watcher.addresses.get_nowait()
+            except queue.Empty:
+                break
+            fu = self.registry.find(key)
+            if fu:
+                fu.ips = ips
+                self.registry.refresh(fu)
+                changed.add(key)
+        for fu in size_scanner.poll():
+            changed.add(fu.config_file_name)
+        for fu in [fu for fu in self.registry.containers if fu.release is None][:16]:
+            fu.release = release_cache.get(fu.etc_path())
+            self.registry.refresh(fu)
+            changed.add(fu.config_file_name)
+        for key in changed:
+            if key in self.registry.by_key:
+                self._broadcast({'event': 'update', 'record': daemon_record(self.registry.by_key[key])})
+
+
+class InventoryClient(threading.Thread):
+    """Connection to an InventoryDaemon, events go to the events queue."""
+    def __init__(self, socket_path=DAEMON_SOCKET):
+        super(InventoryClient, self).__init__(daemon=True)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.events = queue.Queue()
+        self.replies = {}
+        self.answered = threading.Condition()
+        self.send_lock = threading.Lock()
+        self.last_id = 0
+        self.start()
+
+    def send(self, op, **args):
+        args['op'] = op
+        with self.send_lock:
+            self.sock.sendall(('%s\n' % json.dumps(args)).encode())
+
+    def call(self, op, timeout=2.0, **args):
+        with self.answered:
+            self.last_id += 1
+            request_id = self.last_id
+        self.send(op, id=request_id, **args)
+        with self.answered:
+            self.answered.wait_for(lambda: request_id in self.replies, timeout)
+            return self.replies.pop(request_id, None)
+
+    def run(self):
+        try:
+            for line in self.sock.makefile('rb'):
+                message = json.loads(line.decode())
+                if 'id' in message:
+                    with self.answered:
+                        self.replies[message['id']] = message['result']
+                        self.answered.notify_all()
+                else:
+                    self.events.put(message)
+        except (OSError, ValueError):
+            pass
+        self.events.put({'event': 'closed'})
+
+
+class RemoteStateWatcher:
+    """The daemon watches every container, states arrive with its records."""
+    def __init__(self, client):
+        self.client = client
+        self.changes = queue.Queue()
+        self.addresses = queue.Queue()
+        self.visible = set()
+
+    def watch(self, container):
+        pass
+
+    def forget(self, container):
+        pass
+
+    def last_known(self, container):
+        return None, -1
+
+    def check(self, container):
+        self.client.send('check', key=container.config_file_name)
+
+    def wakeup(self):
+        pass
+
+
+class RemoteSizeScanner:
+    """Containers are scanned in the daemon, their sizes arrive with its records. Snapshots are scanned here."""
+    def __init__(self, client):
+        self.client = client
+        self.local = SizeScanner(max_jobs=1)
+
+    def submit(self, container, first=False):
+        if isinstance(container, Snapshot):
+            self.local.submit(container, first)
+        else:
+            self.client.send('size', key=container.config_file_name)
+
+    def busy(self, container):
+        if isinstance(container, Snapshot):
+            return self.local.busy(container)
+        return container.rootfs_bytes is None and container.rootfs_size != '?' or container.rootfs_size.endswith('~')
+
+    def poll(self, timeout=0):
+        return self.local.poll(timeout)
+
+    def cancel(self, container):
+        self.local.cancel(container)
+
+    def cancel_all(self):
+        self.local.cancel_all()
+
+
+class RemoteInfoCache(InfoCache):
+    def __init__(self, client, ttl=2.0):
+        super(RemoteInfoCache, self).__init__(ttl)
+        self.client = client
+
+    def get(self, container):
+        cached = self.entries.get(container.config_file_name)
+        if not cached or time.time() - cached[0] > self.ttl:
+            with profiler.measure('container_info'):
+                info = self.client.call('info', key=container.config_file_name)
+            cached = self.entries[container.config_file_name] = (time.time(), info or ['%-15s %s' % (
+                'Name:', container.name)])
+        return cached[1]
+
+
+class RemoteMetrics:
+    """The daemon samples every running container, series() asks it for one of them."""
+    def __init__(self, client, interval=1.0):
+        self.client = client
+        self.interval = interval
+
+    def track(self, targets):
+        pass
+
+    def forget(self, container):
+        pass
+
+    def series(self, key):
+        return self.client.call('series', key=key) or {'cpu': [], 'memory': [], 'pids': [], 'blkio': []}
+
+
+class RemoteReleaseCache:
+    """Releases arrive with the records of the daemon."""
+    def get(self, path):
+        return None
+
+
+def use_daemon(socket_path=DAEMON_SOCKET):
+    """Puts the remote services in place of the local ones."""
+    global state_watcher, size_scanner, info_cache, metrics_sampler, release_cache
+    client = InventoryClient(socket_path)
+    state_watcher = RemoteStateWatcher(client)
+    size_scanner = RemoteSizeScanner(client)
+    info_cache = RemoteInfoCache(client)
+    metrics_sampler = RemoteMetrics(client)
+    release_cache = RemoteReleaseCache()
+    return client
+
+
+def list_remote(client, fields=LIST_DEFAULT_FIELDS, as_json=False, out=None, timeout=None):
+    """--list against the daemon, sizes and states it does not know yet are asked for."""
+    out = out or sys.stdout
+    wants_size = 'size' in fields or 'allocated' in fields
+    wants_state = bool({'state', 'pid', 'ips'} & set(fields))
+
+    def complete(record):
+        return not (wants_size and record['size'] is None and record['size_text'] != '?' or
+                    wants_state and record['state'] is None or
+                    'release' in fields and record['release'] is None)
+
+    client.send('snapshot')
+    pending = {}
+    deadline = time.time() + timeout if timeout else None
+    while True:
+        try:
+            event = client.events.get(timeout=max(deadline - time.time(), 0) if deadline else None)
+        except queue.Empty:
+            return
+        if event['event'] == 'closed':
+            return
+        if event['event'] == 'snapshot':
+            for record in event['records']:
+                if complete(record):
+                    write_record(out, remote_record(record, fields), fields, as_json)
+                    continue
+                pending[record['key']] = record
+                if wants_size and record['size'] is None:
+                    client.send('size', key=record['key'])
+                if wants_state and record['state'] is None:
+                    client.send('check', key=record['key'])
+        elif event['event'] == 'update' and event['record']['key'] in pending:
+            record = event['record']
+            if complete(record):
+                del pending[record['key']]
+                write_record(out, remote_record(record, fields), fields, as_json)
+        if not pending and event['event'] != 'remove':
+            return
+
+
+def remote_record(record, fields):
+    record = dict(record, pid=record['pid'] if record['pid'] > 0 else None)
+    return {field: record[field] for field in fields}
+
+
+class TemplateCatalog:
+    """Images in the download template cache, a directory is listed again only when its mtime changed."""
+    DEPTH = 4
+
+    def __init__(self, cache_path=None, index_file=None):
+        self.cache_path = cache_path
+        self.index_file = index_file or os.path.join(os.path.expanduser('~'), '.cache', 'lxc-ui', 'templates.json')
+        self.index = None
+
+    def _cache_path(self):
+        if self.cache_path:
+            return self.cache_path
+        if os.path.isdir(os.path.join(os.path.expanduser('~'), '.cache', 'lxc')):
+            return os.path.join(os.path.expanduser('~'), '.cache', 'lxc', 'download')
+        return '/var/cache/lxc/download'
+
+    def _load(self):
+        try:
+            with open(self.index_file) as fp:
+                self.index = json.load(fp)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+            with open('%s.%s' % (self.index_file, os.getpid()), 'w') as fp:
+                json.dump(self.index, fp)
+            os.replace('%s.%s' % (self.index_file, os.getpid()), self.index_file)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _image(path, mtime):
+        """Size of the files of a variant directory and the time its image was built."""
+        size = 0
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    size += entry.stat(follow_symlinks=False).st_size
+        try:
+            with open(os.path.join(path, 'build_id')) as fp:
+                built = time.mktime(time.strptime(fp.read().strip(), '%Y%m%d_%H:%M'))
+        except (OSError, ValueError):
+            built = mtime / 1e9
+        return [size, built]
+
+    def _listing(self, path, depth):
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.index.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1], False
+        if depth < self.DEPTH:
+            with os.scandir(path) as entries:
+                listing = sorted(entry.name for entry in entries if entry.is_dir(follow_symlinks=False))
+        else:
+            listing = self._image(path, mtime)
+        self.index[path] = [mtime, listing]
+        return listing, True
+
+    def templates(self):
+        """(dist, release, arch, variant, size, built) of every cached image in name order."""
+        if self.index is None:
+            self._load()
+        found, seen = [], set()
+        changed = False
+        pending = [(self._cache_path(), ())]
+        while pending:
+            path, parts = pending.pop()
+            try:
+                listing, listed = self._listing(path, len(parts))
+            except OSError:
+                continue
+            seen.add(path)
+            changed = changed or listed
+            if len(parts) == self.DEPTH:
+                found.append(parts + tuple(listing))
+            else:
+                pending.extend((os.path.join(path, name), parts + (name,)) for name in listing)
+        for path in set(self.index) - seen:
+            del self.index[path]
+            changed = True
+        if changed:
+            self._save()
+        return sorted(found)
+
+
+template_catalog = TemplateCatalog()
+
+
+def template_row(template):
+    dist, release, arch, variant, size, built = template
+    name = '/'.join([dist, release, arch] + ([variant] if variant != 'default' else []))
+    return '%-26s %6s %s' % (name, human_size(size), time.strftime('%Y-%m-%d', time.localtime(built)))
+
+
+def keyboard_shortcuts(scr_id, config_paths=None, inventory=None, listing_timeout=10.0):
     def destroy_conteiner(cd):
         if cd.running:
             cd.stop()
             cd.wait("STOPPED", 3)
         cd.destroy()
 
-    def create_container(name, cached_template):
+    def create_container(name, template):
+        """Without a cached image the download template asks for one on the terminal."""
+        if template:
+            lxc_template_data = {'dist': template[0], 'release': template[1], 'arch': template[2]}
+            if template[3] != 'default':
+                lxc_template_data['variant'] = template[3]
+            jobs = [provision_queue.submit('create', new_name, lxc_storage.config_paths[0], lxc_template_data)
+                    for new_name in expand_names(name)]
+            provision_batches.append(ProvisionBatch(jobs, lxc_storage.config_paths[0]))
+            return False
         if not curses.isendwin():
             curses.endwin()
-        cd = lxc.Container(name)
-        cached_template = cached_template.split('/')
-        lxc_template_data = {}
-        if cached_template[0] != 'Default':
-            lxc_template_data = {'dist': cached_template[0], 'release': cached_template[1], 'arch': cached_template[2]}
-        cd.create('download', 0, lxc_template_data)
+        cd = lxc.Container(name, lxc_storage.config_paths[0])
+        cd.create('download', 0, {})
         input('Press ENTER to continue')
+        return True
 
     def run_console(container):
         if not curses.isendwin():
@@ -537,12 +2808,15 @@ def keyboard_shortcuts(scr_id):
         else:
             return None
 
+    def menu_width(menu_type):
+        return sum(len(item) + 2 for item in menu_type)
+
     def init_menu_panel():
-        m_any_w = curses.newwin(1, 75, size_y - 1, 0)
+        m_any_w = curses.newwin(1, menu_width(menu_any), size_y - 1, 0)
         m_any_p = curses.panel.new_panel(m_any_w)
-        m_run_w = curses.newwin(1, 75, size_y - 1, 75)
+        m_run_w = curses.newwin(1, 75, size_y - 1, menu_width(menu_any))
         m_run_p = curses.panel.new_panel(m_run_w)
-        m_stop_w = curses.newwin(1, 75, size_y - 1, 75)
+        m_stop_w = curses.newwin(1, 75, size_y - 1, menu_width(menu_any))
         m_stop_p = curses.panel.new_panel(m_stop_w)
         return {'any': (m_any_w, m_any_p), 'run': (m_run_w, m_run_p), 'stop': (m_stop_w, m_stop_p)}
 
@@ -557,21 +2831,6 @@ def keyboard_shortcuts(scr_id):
             except:
                 pass
 
-    def scan_cache_folders():
-        buf = []
-        if os.path.isdir('%s/.cache/lxc' % os.environ['HOME']):
-            cache_path = '%s/.cache/lxc/download' % os.environ['HOME']
-        else:
-            cache_path = '/var/cache/lxc/dowload'
-        try:
-            for top in os.listdir(cache_path):
-                buf.extend(['/'.join(d[0].split('/')[-3:])
-                            for d in os.walk('%s/%s' % (cache_path, top))
-                            if 'default' in d[1]])
-        except FileNotFoundError:
-            pass
-        return buf
-
     def interface_dialog():
         def lxc_add_if():
             lxc_interface = lxc.ContainerNetworkList(lxc_storage[lxc_win.value])
@@ -693,9 +2952,8 @@ def keyboard_shortcuts(scr_id):
             return None
 
     def new_lxc_dialog():
-        cache_list = scan_cache_folders()
-
-        cache_list.insert(0, 'Default')
+        templates = template_catalog.templates()
+        cache_list = ['Default'] + [template_row(template) for template in templates]
         lxc_name = EditBar(5, int(size_x / 2) - 50, 50, 3, curses.color_pair(3),
                            curses.color_pair(3), ' New LXC ', '', False)
         lxc_template = RadioList(8, int(size_x / 2) - 50, 50, 18, curses.color_pair(3),
@@ -705,48 +2963,243 @@ def keyboard_shortcuts(scr_id):
                            curses.color_pair(3), 'Cancel', 0)
         start_dialog = Dialog(lxc_name, lxc_template, lxc_OK, lxc_Cancel)
         start_dialog.keyboard()
-        return (''.join(lxc_name.value), lxc_template.rlist[lxc_template.value]) if lxc_OK.checked else None
+        if not lxc_OK.checked:
+            return None
+        return ''.join(lxc_name.value), templates[lxc_template.value - 1] if lxc_template.value else None
+
+    def clone_dialog(methods):
+        clone_name = EditBar(5, int(size_x / 2) - 50, 50, 3, curses.color_pair(3),
+                             curses.color_pair(3), ' Clone name, web{1..20} for several ', '', False)
+        count = EditBar(8, int(size_x / 2) - 50, 50, 3, curses.color_pair(3),
+                        curses.color_pair(3), ' Clones (fan-out) ', '1', True)
+        method = RadioList(11, int(size_x / 2) - 50, 50, 8, curses.color_pair(3),
+                           curses.color_pair(3), methods, ' Method ')
+        lxc_OK = Button(19, int(size_x / 2) - 50, 25, 3, curses.color_pair(3), curses.color_pair(3), 'OK', 1)
+        lxc_Cancel = Button(19, int((size_x / 2) - 50 + 25), 25, 3, curses.color_pair(3),
+                            curses.color_pair(3), 'Cancel', 0)
+        start_dialog = Dialog(clone_name, count, method, lxc_OK, lxc_Cancel)
+        start_dialog.keyboard()
+        if not lxc_OK.checked or not clone_name.value:
+            return None
+        return ''.join(clone_name.value), int(''.join(count.value) or 1), method.rlist[method.value]
+
+    def fan_out(name, count):
+        """Names of the clones, a range in name wins over count."""
+        names = expand_names(name)
+        if len(names) > 1 or count <= 1:
+            return names
+        return ['%s%0*d' % (name, len(str(count)), number) for number in range(1, count + 1)]
+
+    def start_clones(source, names, method):
+        config_path = source.get_config_path()
+        jobs = [provision_queue.submit('clone', new_name, config_path, {'source': source.name, 'method': method})
+                for new_name in names]
+        if source.rootfs_allocated is None:
+            source.fork_size_calc()
+        provision_batches.append(ProvisionBatch(jobs, config_path, source))
+        lxc_win.set_title(list_title())
 
     def snapshot_dialog():
+        """Ins marks snapshots, DEL/X deletes the marked ones or the current one in a background job."""
+        def snap_title():
+            known = [snap.rootfs_bytes for snap in snapshots if snap.rootfs_bytes is not None]
+            return ' Snapshots: %s, %s%s ' % (len(snapshots), human_size(sum(known)),
+                                                '' if len(known) == len(snapshots) else '+')
+
+        def snap_mark():
+            if snapshots and not snapshots[lxc_snap.value].deleting:
+                snap = snapshots[lxc_snap.value]
+                snap.marked = not snap.marked
+                snap_rows()
+
+        def snap_rows():
+            lxc_snap.rlist[:] = [snap.row() for snap in snapshots]
+            lxc_snap.set_title(snap_title())
+            lxc_snap.print_rlist()
+
         def snap_rm():
-            snap_name = lxc_snap.rlist[lxc_snap.cursor_pos - 1].split(' ')[0]
-            lxc_storage[lxc_win.value].snapshot_destroy(snap_name)
+            if not snapshots:
+                return
+            doomed = [snap for snap in snapshots if snap.marked] or \
+                     [snap for snap in snapshots[lxc_snap.value:lxc_snap.value + 1] if not snap.deleting]
+            if not doomed:
+                return
+            for snap in doomed:
+                snap.marked, snap.deleting = False, True
+                size_scanner.cancel(snap)
+            deleting.append((provision_queue.submit('snap-del', container.name, container.get_config_path(),
+                                                    {'snapshots': [snap.name for snap in doomed]}), doomed))
+            snap_rows()
+
+        def snap_deleted():
+            """Rows go once their delete job is done, the ones it failed to destroy stay."""
+            if provision_queue.pending:
+                update_jobs()
+            done = [(job, doomed) for job, doomed in deleting if job.result]
+            if not done:
+                return False
+            left = {snap[0] for snap in container.snapshot_list()}
+            for job, doomed in done:
+                deleting.remove((job, doomed))
+                for snap in doomed:
+                    snap.deleting = False
+                    if snap.name not in left:
+                        snapshots.remove(snap)
             lxc_snap.cursor_pos = lxc_snap.value = 0
-            lxc_snap.rlist = [" ".join([snap[0], snap[2]]) for snap in lxc_storage[lxc_win.value].snapshot_list()]
-            lxc_snap.update()
-
-        snap_list = [" ".join([snap[0], snap[2]]) for snap in lxc_storage[lxc_win.value].snapshot_list()]
+            lxc_snap.win_id.erase()
+            return True
+
+        def snap_poll():
+            changed = size_scanner.poll()
+            for fu in changed:
+                lxc_storage.refresh(fu)
+            if snap_deleted() or any(snap in changed for snap in snapshots):
+                snap_rows()
+
+        container = lxc_storage[lxc_win.value]
+        snapshots = [Snapshot(snap[0], snap[2], snap[3]) for snap in container.snapshot_list()]
+        deleting = []
+        for snap in reversed(snapshots):
+            size_scanner.submit(snap, first=True)
         lxc_snap = RadioList(5, int(size_x / 2) - 50, 50, 18, curses.color_pair(3),
-                                 curses.color_pair(3), snap_list, ' Snapshot list ')
+                                 curses.color_pair(3), [snap.row() for snap in snapshots], snap_title())
         lxc_OK = Button(23, int(size_x / 2) - 50, 25, 3, curses.color_pair(3), curses.color_pair(3), 'Restore', 1)
         lxc_Cancel= Button(23, int((size_x / 2) - 50  + 25), 25, 3, curses.color_pair(3),
                            curses.color_pair(3), 'Cancel', 0)
+        for element in (lxc_snap, lxc_OK, lxc_Cancel):
+            element.win_id.timeout(300)
         sb = StatusBar(26, int(size_x / 2) - 50, 50, 3,
                        curses.color_pair(3),
                        curses.color_pair(3),
-                       'DEL/X: delete snaphot')
+                       'Ins: mark DEL/X: delete marked')
         start_dialog = Dialog(lxc_snap, lxc_OK, lxc_Cancel)
-        start_dialog.key_map = {330: snap_rm, 120: snap_rm}
+        start_dialog.key_map = {330: snap_rm, 120: snap_rm, 331: snap_mark, -1: snap_poll}
         start_dialog.keyboard()
-        return lxc_snap.rlist[lxc_snap.cursor_pos - 1].split(' ')[0] if lxc_OK.checked else None
+        for snap in snapshots:
+            size_scanner.cancel(snap)
+        if not lxc_OK.checked or not snapshots or snapshots[lxc_snap.value].deleting:
+            return None
+        return snapshots[lxc_snap.value].name
 
     def show_me_screen():
         nonlocal lxc_win, size_y, size_x, menu_panel, menu_panels, panel
         size_y, size_x = scr_id.getmaxyx()
-        lxc_win = MenuList(0, 0, size_x, size_y - 11, curses.color_pair(1), curses.color_pair(1), lxc_list, "LXC list")
+        lxc_win = MenuList(0, 0, size_x, size_y - 11, curses.color_pair(1), curses.color_pair(1), lxc_storage.rows,
+                           "LXC list")
         menu_panels = init_menu_panel()
         menu(menu_panels['any'][0], menu_any)
         menu(menu_panels['run'][0], menu_run)
         menu(menu_panels['stop'][0], menu_stop)
 
-    def get_all_lxc_list():
-        nonlocal lxc_storage, lxc_list
-        lxc_storage = my_list_containers(as_object=True)
-        return (lxc_storage, ['[%s] %-8s %-50s %s' % ('R' if fu.init_pid > 0 else 'S',
-                                            fu.get_rootfs_size(),
-                                            fu.name,
-                                            get_release_info(str(fu.config_file_name).replace('config', 'rootfs/etc/')))
-                              for fu in lxc_storage])
+    def repaint():
+        scr_id.touchwin()
+        lxc_win.win_id.touchwin()
+        for menu_win, menu_panel in menu_panels.values():
+            menu_win.touchwin()
+
+    def list_changed():
+        lxc_win.value = min(lxc_win.value, max(len(lxc_storage) - 1, 0))
+        lxc_win.update()
+
+    def apply_state_changes():
+        changed = False
+        while True:
+            try:
+                key, state, pid = state_watcher.changes.get_nowait()
+            except queue.Empty:
+                break
+            fu = lxc_storage.find(key)
+            if fu:
+                fu.known_state, fu.known_pid = state, pid
+                if pid <= 0:
+                    fu.ips = []
+                lxc_storage.refresh(fu)
+                changed = True
+        while True:
+            try:
+                key, ips = state_watcher.addresses.get_nowait()
+            except queue.Empty:
+                break
+            fu = lxc_storage.find(key)
+            if fu:
+                fu.ips = ips
+                lxc_storage.refresh(fu)
+        return changed
+
+    def fill_visible():
+        """Reads the releases of the rows on screen and lets the state watcher query them first."""
+        first = lxc_win.page * lxc_win.y_max
+        visible = lxc_storage[first:first + lxc_win.y_max]
+        keys = {fu.config_file_name for fu in visible}
+        if keys != state_watcher.visible:
+            state_watcher.visible = keys
+        for fu in visible:
+            if fu.release is None:
+                fu.release = release_cache.get(fu.etc_path())
+                lxc_storage.refresh(fu)
+
+    def fill_hidden_releases(limit=16):
+        """Reads a few releases of the other containers per frame while a filter or the release order needs them."""
+        for fu in lxc_storage.containers:
+            if fu.release is None:
+                fu.release = release_cache.get(fu.etc_path())
+                lxc_storage.refresh(fu)
+                limit -= 1
+                if not limit:
+                    break
+
+    def selected():
+        return lxc_storage[lxc_win.value] if lxc_storage else None
+
+    def follow(current):
+        """Keeps the cursor on current after rows moved."""
+        index = lxc_storage.index(current) if current is not None and current in lxc_storage else None
+        if index is not None:
+            lxc_win.value = index
+
+    def list_title():
+        return 'LXC list%s%s%s%s%s' % ('' if lxc_storage.sort_by == 'name' else ' by %s' % lxc_storage.sort_by,
+                                     ' /%s' % lxc_storage.query if filtering or lxc_storage.query else '',
+                                     ' (listing %s)' % len(lxc_storage.containers) if lxc_storage.busy() else '',
+                                     ' (%s stalled)' % ', '.join(sorted(lxc_storage.stalled)) if lxc_storage.stalled
+                                     else '',
+                                     ' [%s jobs]' % provision_queue.pending if provision_queue.pending else '')
+
+    def set_sort(sort_by):
+        current = selected()
+        lxc_storage.set_sort(sort_by)
+        follow(current)
+        lxc_win.set_title(list_title())
+        list_changed()
+
+    def set_filter(query):
+        nonlocal shown_info
+        current = selected()
+        lxc_storage.set_filter(query)
+        lxc_win.value = 0
+        follow(current)
+        lxc_win.set_title(list_title())
+        list_changed()
+        shown_info = None
+        if not lxc_storage:
+            clear_info()
+
+    def edit_filter(key):
+        nonlocal filtering
+        query = lxc_storage.query
+        if key in (10, 27):
+            filtering = False
+            if key == 27:
+                query = ''
+        elif key in (263, 127, 8):
+            query = query[:-1]
+        elif 32 <= key < 127:
+            query += chr(key)
+        set_filter(query)
+
+    def update_sizes():
+        for fu in size_scanner.poll():
+            lxc_storage.refresh(fu)
 
     def stop_it():
         if lxc_storage[lxc_win.value].running:
@@ -757,10 +3210,75 @@ def keyboard_shortcuts(scr_id):
                            curses.color_pair(3) | curses.A_BLINK, 'WAIT')
                 curses.panel.update_panels()
                 lxc_storage[lxc_win.value].wait("STOPPED", 3)
-                lxc_list[lxc_win.value] = lxc_list[lxc_win.value].replace('[R]', '[S]')
+                state_watcher.check(lxc_storage[lxc_win.value])
                 del sb
                 curses.panel.update_panels()
 
+    def marked_or_none(states):
+        """Marked rows hidden by the filter count as well."""
+        marked = [fu for fu in lxc_storage.containers if fu.marked]
+        return [fu for fu in marked if fu.known_state in states] if marked else None
+
+    def clear_marks():
+        for fu in [fu for fu in lxc_storage.containers if fu.marked]:
+            fu.marked = False
+            lxc_storage.refresh(fu)
+
+    def open_progress_panel():
+        nonlocal bulk_panel, bulk_stats
+        bulk_panel = List(size_y - 11, 0, size_x, 10, curses.color_pair(3), curses.color_pair(3), [])
+        bulk_panel.win_id.immedok(False)
+        bulk_stats = {}
+        repaint()
+
+    def start_bulk(action, containers):
+        if not containers:
+            return
+        if bulk_panel is None or not progress_busy():
+            open_progress_panel()
+        bulk_stats.setdefault(action, [0, 0])[1] += len(containers)
+        bulk_executor.submit(containers, action)
+        update_bulk()
+
+    def start_boot():
+        nonlocal boot_thread
+        if progress_busy():
+            return
+        open_progress_panel()
+        boot_thread = threading.Thread(target=boot_host, args=(boot_plan(lxc_storage.containers),), daemon=True,
+                                       kwargs={'report': lambda line, result=None: boot_events.put((line, result))})
+        boot_thread.start()
+        update_bulk()
+
+    def progress_busy():
+        return bulk_executor.pending or (boot_thread is not None and boot_thread.is_alive())
+
+    def bulk_result(key, action, result):
+        fu = lxc_storage.find(key)
+        if fu:
+            state_watcher.check(fu)
+            if action in ('start', 'stop') and result == 'OK':
+                fu.fork_size_calc()
+
+    def update_bulk():
+        for key, name, action, result, elapsed in bulk_executor.poll():
+            bulk_result(key, action, result)
+            bulk_stats[action][0] += 1
+            bulk_panel.rlist.append(result_line(name, action, result, elapsed))
+        while not boot_events.empty():
+            line, result = boot_events.get()
+            if result:
+                bulk_result(result[0], result[2], result[3])
+            bulk_panel.rlist.append(line)
+        if bulk_panel is not None:
+            bulk_panel.title = ' %s%s ' % (', '.join(['%s %s/%s' % (action, done, total)
+                                                      for action, (done, total) in bulk_stats.items()] +
+                                                     (['boot'] if boot_thread and boot_thread.is_alive() else [])),
+                                           '' if progress_busy() else ' - done, press any key')
+            bulk_panel.value = max(len(bulk_panel.rlist) - 1, 0)
+            bulk_panel.invalidate()
+            bulk_panel.update()
+
     def warning(warn_txt, b_title):
         warning = StatusBar(5, int(size_x / 2) - 40, 40, 5,
                        curses.color_pair(3),
@@ -777,78 +3295,358 @@ def keyboard_shortcuts(scr_id):
             curses.endwin()
         lxc_storage[lxc_win.value].attach_wait(lxc.attach_run_command, cmd)
 
-    def container_full_info():
-        proc = subprocess.Popen(["lxc-info", "-n", lxc_storage[lxc_win.value].name],stdout=subprocess.PIPE)
-        scr_id.move(size_y - 11, 0)
-        scr_id.clrtobot()
-        for offset, info_line in enumerate(proc.stdout.readlines()):
-            if info_line.startswith("Link:".encode()):
+    def dashboard():
+        def dashboard_row(fu):
+            series = metrics_sampler.series(fu.config_file_name)
+            last = {counter: values[-1] if values and values[-1] is not None else None
+                    for counter, values in series.items()}
+            return (last['cpu'] or 0,
+                    '%-24s %6s %-12s %8s %-12s %5s %8s %-12s' % (
+                        fu.name[:24],
+                        '%.1f%%' % last['cpu'] if last['cpu'] is not None else '-',
+                        sparkline(series['cpu'], 12),
+                        human_size(last['memory']) if last['memory'] is not None else '-',
+                        sparkline(series['memory'], 12),
+                        last['pids'] if last['pids'] is not None else '-',
+                        '%s/s' % human_size(last['blkio']) if last['blkio'] is not None else '-',
+                        sparkline(series['blkio'], 12)))
+
+        def track_running():
+            running = [fu for fu in lxc_storage.containers if fu.known_pid > 0]
+            metrics_sampler.track((fu.config_file_name, (fu.name, fu.known_pid)) for fu in running)
+            return running
+
+        running = track_running()
+        tracked_at = time.time()
+        board = MenuList(0, 0, size_x, size_y - 11, curses.color_pair(1), curses.color_pair(1), [],
+                         ' %-23s %6s %-12s %8s %-12s %5s %8s %-12s ' % ('Dashboard', 'CPU', '', 'Memory', '',
+                                                                        'Pids', 'BlkIO', ''))
+        board.win_id.timeout(int(metrics_sampler.interval * 1000))
+        while True:
+            if time.time() - tracked_at > 5:
+                running = track_running()
+                tracked_at = time.time()
+            board.rlist[:] = [row for cpu, row in sorted((dashboard_row(fu) for fu in running),
+                                                          key=lambda r: r[0], reverse=True)]
+            board.value = min(board.value, max(len(board.rlist) - 1, 0))
+            board.update()
+            curses.panel.update_panels()
+            curses.doupdate()
+            key = board.win_id.getch()
+            if key in (27, 113, 119):
                 break
-            scr_id.addstr(size_y - (11 - offset), 0, info_line, curses.color_pair(2))
+            board.action(key)
+        del board
+        repaint()
+        curses.panel.update_panels()
 
+    def update_jobs():
+        done = provision_queue.poll()
+        for job in done:
+            if job.result != 'OK':
+                continue
+            if job.action in ('create', 'clone'):
+                lxc_storage.add(job.name, job.config_path)
+                lxc_storage.announce()
+            elif job.action == 'restore' and (os.path.normpath(job.config_path), job.name) in lxc_storage.by_name:
+                lxc_storage.by_name[os.path.normpath(job.config_path), job.name].fork_size_calc()
+        if done:
+            lxc_win.set_title(list_title())
+            list_changed()
+        for batch in [batch for batch in provision_batches if batch.done()]:
+            provision_batches.remove(batch)
+            report_batch(batch)
+
+    def report_batch(batch):
+        """Results and savings of a batch go to the progress panel."""
+        if bulk_panel is None or not progress_busy():
+            open_progress_panel()
+        action = batch.jobs[0].action
+        bulk_stats.setdefault(action, [0, 0])
+        bulk_stats[action][0] += len(batch.jobs)
+        bulk_stats[action][1] += len(batch.jobs)
+        bulk_panel.rlist.extend([result_line(job.name, job.action, job.result, job.elapsed) for job in batch.jobs])
+        bulk_panel.rlist.extend(batch.summary())
+        update_bulk()
+
+    def jobs_view():
+        """Creates and clones of this session, Enter shows the log of a job until Esc."""
+        board = MenuList(0, 0, size_x, size_y - 11, curses.color_pair(1), curses.color_pair(1), [],
+                         ' %-6s %-8s %-40s %8s  %s ' % ('Jobs', '', 'Name', 'Time', 'Log'))
+        board.win_id.timeout(500)
+        shown = None
+        while True:
+            if provision_queue.pending:
+                update_jobs()
+            if shown is None:
+                board.rlist[:] = [job.row() for job in provision_queue.jobs]
+            else:
+                board.rlist[:] = shown.log_tail(1000)
+            board.value = min(board.value, max(len(board.rlist) - 1, 0))
+            board.update()
+            curses.panel.update_panels()
+            curses.doupdate()
+            key = board.win_id.getch()
+            if key == 10 and shown is None and provision_queue.jobs:
+                shown = provision_queue.jobs[board.value]
+                board.set_title(' %s %s: %s ' % (shown.action, shown.name, shown.log_file))
+                board.value = max(len(shown.log_tail(1000)) - 1, 0)
+                board.invalidate()
+                continue
+            if key in (27, 113) and shown is not None:
+                shown = None
+                board.set_title(' %-6s %-8s %-40s %8s  %s ' % ('Jobs', '', 'Name', 'Time', 'Log'))
+                board.value = 0
+                board.invalidate()
+                continue
+            if key in (27, 113, 106):
+                break
+            board.action(key)
+        del board
+        repaint()
+        curses.panel.update_panels()
 
-    menu_any = ['C:Create', 'D:Destroy', 'E:Properties', 'I:Interfaces', 'Space:Disk usage', 'Q:Exit']
+    def usage_view(fu):
+        """ncdu like browser over the last scan of the rootfs."""
+        def usage_rows(index):
+            entries = [(tree.total[kid], '%s/' % tree.names[kid], kid) for kid in tree.subdirs(index)]
+            entries.append((tree.own[index], '(files)', None))
+            entries.sort(key=lambda entry: entry[0], reverse=True)
+            largest = max(entries[0][0], 1)
+            parent_total = max(tree.total[index], 1)
+            rows = ['%9s %5.1f%% [%-10s] %s' % (human_size(size), size * 100 / parent_total,
+                                                '#' * int(round(size * 10 / largest)), name)
+                    for size, name, kid in entries]
+            return rows, [kid for size, name, kid in entries]
+
+        def show(index, value=0):
+            nonlocal current, kids
+            current = index
+            board.rlist[:], kids = usage_rows(index)
+            board.value = value
+            board.title = ' %s %s%s ' % (tree.path(index), human_size(tree.total[index]),
+                                         '' if tree.complete else ' (partial scan)')
+            board.win_id.erase()
+            board.invalidate()
+
+        board = MenuList(0, 0, size_x, size_y - 11, curses.color_pair(1), curses.color_pair(1), [],
+                         ' Disk usage: scanning %s ' % fu.rootfs_path())
+        board.win_id.timeout(200)
+        tree, current, kids, trail = usage_trees.get(fu.rootfs_path()), 0, [], []
+        if tree is None:
+            fu.fork_size_calc()
+        else:
+            show(0)
+        while True:
+            if tree is None and not size_scanner.busy(fu):
+                tree = usage_trees.get(fu.rootfs_path())
+                if tree is None:
+                    board.set_title(' Disk usage: %s could not be scanned ' % fu.rootfs_path())
+                else:
+                    fu.rootfs_bytes, fu.rootfs_allocated = tree.totals()
+                    fu.rootfs_size = human_size(fu.rootfs_bytes)
+                    lxc_storage.refresh(fu)
+                    show(0)
+            board.value = min(board.value, max(len(board.rlist) - 1, 0))
+            board.update()
+            curses.panel.update_panels()
+            curses.doupdate()
+            key = board.win_id.getch()
+            if tree is None:
+                lxc_storage.poll()
+                update_sizes()
+            if key in (27, 113):
+                break
+            if tree is not None and key in (10, 261) and kids and kids[board.value] is not None:
+                trail.append((current, board.value))
+                show(kids[board.value])
+            elif tree is not None and key in (263, 127, 260) and trail:
+                show(*trail.pop())
+            else:
+                board.action(key)
+        del board
+        repaint()
+        curses.panel.update_panels()
+
+    def toggle_profile():
+        nonlocal profile_panel
+        if profile_panel is None:
+            profile_panel = List(1, size_x - 52, 50, 14, curses.color_pair(3), curses.color_pair(3), [],
+                                 '%-19s %7s %9s %9s' % ('Profile', 'calls', 'last ms', 'p95 ms'))
+            profile_panel.win_id.immedok(False)
+        else:
+            profile_panel = None
+            lxc_win.invalidate()
+        repaint()
+
+    def update_profile():
+        profile_panel.rlist[:] = ['%-20s %7d %9.2f %9.2f' % row for row in profiler.report()]
+        profile_panel.update()
+
+    def clear_info():
+        for line in range(size_y - 11, size_y - 1):
+            scr_id.move(line, 0)
+            scr_id.clrtoeol()
+
+    def container_full_info():
+        nonlocal shown_info
+        info = (lxc_storage[lxc_win.value].name, info_cache.get(lxc_storage[lxc_win.value]))
+        if info == shown_info:
+            return
+        shown_info = info
+        lxc_storage.refresh(lxc_storage[lxc_win.value])
+        clear_info()
+        for offset, info_line in enumerate(info[1][:10]):
+            scr_id.addstr(size_y - (11 - offset), 0, info_line, curses.color_pair(2))
+
+    menu_any = ['C:Create', 'D:Destroy', 'E:Properties', 'I:Interfaces', 'Space:Disk usage', 'W:Dashboard',
+                'A:Usage', 'Ins:Mark', 'B:Boot', 'J:Jobs', '/:Filter', '1-4:Sort', 'P:Profile', 'Q:Exit']
     menu_run = ['S:Stop', 'F:Freeze', 'U:Unfreeze', 'T:Console', 'Ctrl+T: Cmd exec', 'Ctrl+O: ctop']
     menu_stop = ['R:Run', 'L:Clone', 'N:Rename', 'M:Snapshot', 'O:Snapshot menu']
     cursor_pos = 1
     cur_page = 0
 
     lxc_win, size_y, size_x, menu_panel, menu_panels, panel = None, 0, 0, None, None, None
-    lxc_storage, lxc_list = get_all_lxc_list()
+    shown_info = None
+    bulk_panel, bulk_stats = None, {}
+    boot_thread, boot_events = None, queue.Queue()
+    provision_batches = []
+    filtering = False
+    profile_panel, key_time = None, None
+    info_debounce = 0.15
+    last_key_time = 0
+    lxc_storage = ContainerRegistry(config_paths, inventory, budget=0.03, listing_timeout=listing_timeout)
+    lxc_storage.sync()
     show_me_screen()
+    lxc_win.set_title(list_title())
 
     curses.panel.update_panels()
     scr_id.refresh()
+    scr_id.timeout(int(info_debounce * 1000))
     key = 0
     while True:
-        if lxc_storage:
-            container_full_info()
-        if len(lxc_storage) and lxc_storage[lxc_win.value].state == "RUNNING":
-            menu_panels['run'][1].show()
-            menu_panels['stop'][1].hide()
-        if len(lxc_storage) and lxc_storage[lxc_win.value].state == "STOPPED":
-            menu_panels['run'][1].hide()
-            menu_panels['stop'][1].show()
-        curses.panel.update_panels()
-        lxc_win.update()
+        current = selected()
+        with profiler.measure('update'):
+            if lxc_storage.busy() or lxc_storage.stalled or lxc_storage.inventory:
+                busy, stalled = lxc_storage.busy(), len(lxc_storage.stalled)
+                lxc_storage.poll()
+                if busy or lxc_storage.busy() or stalled != len(lxc_storage.stalled):
+                    lxc_win.set_title(list_title())
+                    scr_id.timeout(10 if lxc_storage.busy() else int(info_debounce * 1000))
+            if lxc_storage and time.time() - last_key_time >= info_debounce:
+                container_full_info()
+            if apply_state_changes() or key != -1:
+                if len(lxc_storage) and lxc_storage[lxc_win.value].known_state == "RUNNING":
+                    menu_panels['run'][1].show()
+                    menu_panels['stop'][1].hide()
+                if len(lxc_storage) and lxc_storage[lxc_win.value].known_state == "STOPPED":
+                    menu_panels['run'][1].hide()
+                    menu_panels['stop'][1].show()
+            update_sizes()
+            if bulk_panel is not None and (progress_busy() or not boot_events.empty()):
+                update_bulk()
+            if provision_queue.pending:
+                update_jobs()
+            fill_visible()
+            if filtering or lxc_storage.query or lxc_storage.sort_by == 'release':
+                fill_hidden_releases()
+        with profiler.measure('frame'):
+            follow(current)
+            list_changed()
+            if profile_panel is not None:
+                update_profile()
+            scr_id.noutrefresh()
+            curses.panel.update_panels()
+            curses.doupdate()
+        if key_time is not None:
+            profiler.record('key_to_frame', time.perf_counter() - key_time)
+            key_time = None
         key = scr_id.getch()
+        if key == -1:
+            continue
+        key_time = time.perf_counter()
+        last_key_time = time.time()
+        if filtering and key not in (258, 259, 338, 339, 262, 360, curses.KEY_RESIZE):
+            edit_filter(key)
+            continue
         lxc_win.action(key)
+        if bulk_panel is not None and not progress_busy() and boot_events.empty():
+            bulk_panel = None
+            shown_info = None
+            repaint()
+        if key not in (258, 259, 338, 339, 262, 360):
+            shown_info = None
+            if lxc_storage:
+                info_cache.forget(lxc_storage[lxc_win.value])
 
         if key == curses.KEY_RESIZE:
             size_y, size_x = scr_id.getmaxyx()
             menu_panels['any'][1].move(size_y - 1 , 0)
-            if size_x > 175:
-                menu_panels['run'][1].move(size_y - 1 , 75)
-                menu_panels['stop'][1].move(size_y - 1 , 75)
+            if size_x > menu_width(menu_any) + 100:
+                menu_panels['run'][1].move(size_y - 1 , menu_width(menu_any))
+                menu_panels['stop'][1].move(size_y - 1 , menu_width(menu_any))
             lxc_win.win_id.resize(size_y - 11, size_x)
+            lxc_win.h, lxc_win.w, lxc_win.y_max = size_y - 11, size_x, size_y - 13
+            lxc_win.win_id.erase()
+            lxc_win.invalidate()
+            shown_info = None
         elif key == 113:
+            if provision_queue.pending and not warning('%s jobs still running, quit???' % provision_queue.pending,
+                                                       'Quit'):
+                continue
             shutdown_curses(scr_id)
-            for lc in lxc_storage:
-                if lc.p and lc.p.is_alive():
-                    lc.p.terminate()
+            size_scanner.cancel_all()
+            bulk_executor.close()
+            provision_queue.close()
             break
         elif key == 100 and lxc_storage:
             if warning('Destroy container???', 'Destroy It!'):
                 destroy_conteiner(lxc_storage[lxc_win.value])
-                lxc_storage, lxc_list = get_all_lxc_list()
-                lxc_win.rlist.clear()
-                lxc_win.win_id.clear()
+                lxc_storage.remove(lxc_storage[lxc_win.value].name, lxc_storage[lxc_win.value].get_config_path())
+                lxc_storage.announce()
+                list_changed()
                 lxc_win.focus()
-                if len(lxc_list) > 0:
-                    lxc_win.rlist.extend(lxc_list)
+                if len(lxc_storage) > 0:
                     lxc_win.action(259)
 
         elif key == 99:
             nlxcdata = new_lxc_dialog()
-            if nlxcdata:
-                create_container(*nlxcdata)
-                lxc_storage, lxc_list = get_all_lxc_list()
-                lxc_win.rlist.clear()
-                lxc_win.rlist.extend(lxc_list)
+            if nlxcdata and create_container(*nlxcdata):
+                lxc_storage.add(nlxcdata[0])
+                lxc_storage.announce()
+                list_changed()
+            elif nlxcdata:
+                lxc_win.set_title(list_title())
+
+        elif key == 106:
+            '''j key'''
+            jobs_view()
+
+        elif key == 97:
+            '''a key'''
+            if lxc_storage:
+                usage_view(lxc_storage[lxc_win.value])
+
+        elif key == 119:
+            '''w key'''
+            dashboard()
+
+        elif key in (49, 50, 51, 52):
+            '''1-4 keys'''
+            set_sort(('name', 'state', 'size', 'release')[key - 49])
+
+        elif key == 112:
+            '''p key'''
+            toggle_profile()
+
+        elif key == 47:
+            '''/ key'''
+            filtering = True
+            set_filter(lxc_storage.query)
 
         elif key == 15:
             '''Ctrl+O'''
-            if lxc_storage[lxc_win.value].state == "RUNNING":
+            if lxc_storage[lxc_win.value].known_state == "RUNNING":
                 attach_console(["top"])
 
         elif key == 20:
@@ -859,22 +3657,52 @@ def keyboard_shortcuts(scr_id):
 
         elif key == 111:
             '''o key'''
-            sndil = snapshot_dialog()
+            sndil = snapshot_dialog() if lxc_storage else None
             if sndil:
-                if lxc_storage[lxc_win.value].state == "RUNNING":
+                if lxc_storage[lxc_win.value].known_state == "RUNNING":
                     lxc_win.update()
                     if not warning('Container need to be stopped!', 'Stop It!'):
                         continue
                     lxc_win.update()
                     stop_it()
-                lxc_storage[lxc_win.value].snapshot_restore(sndil)
+                provision_queue.submit('restore', lxc_storage[lxc_win.value].name,
+                                       lxc_storage[lxc_win.value].get_config_path(), {'snapshot': sndil})
+            lxc_win.set_title(list_title())
 
         elif key == 109:
             '''m key'''
-            if not curses.isendwin():
-                curses.endwin()
-            lxc_storage[lxc_win.value].snapshot()
-            input('Press ENTER to continue')
+            if lxc_storage:
+                provision_queue.submit('snapshot', lxc_storage[lxc_win.value].name,
+                                       lxc_storage[lxc_win.value].get_config_path())
+                lxc_win.set_title(list_title())
+
+        elif key == 98:
+            '''b key'''
+            if warning('Boot all autostart containers???', 'Boot'):
+                start_boot()
+
+        elif key == 331:
+            '''Insert key'''
+            if lxc_storage:
+                lxc_storage[lxc_win.value].marked = not lxc_storage[lxc_win.value].marked
+                lxc_storage.refresh(lxc_storage[lxc_win.value])
+                lxc_win.action(258)
+
+        elif key == 42:
+            '''* key'''
+            for fu in lxc_storage:
+                fu.marked = not fu.marked
+                lxc_storage.refresh(fu)
+
+        elif key in (114, 115, 102, 117) and marked_or_none(()) is not None:
+            action, states = {114: ('start', ('STOPPED',)),
+                              115: ('stop', ('RUNNING', 'FROZEN')),
+                              102: ('freeze', ('RUNNING',)),
+                              117: ('unfreeze', ('FROZEN',))}[key]
+            targets = marked_or_none(states)
+            if targets and (action != 'stop' or warning('Stop %s containers???' % len(targets), 'Stop It!')):
+                start_bulk(action, targets)
+                clear_marks()
 
         elif key == 114:
             lxc_storage[lxc_win.value].start()
@@ -883,7 +3711,7 @@ def keyboard_shortcuts(scr_id):
                            curses.color_pair(3) | curses.A_BLINK, 'WAIT')
             curses.panel.update_panels()
             lxc_storage[lxc_win.value].wait("RUNNING", 3)
-            lxc_list[lxc_win.value] = lxc_list[lxc_win.value].replace('[S]', '[R]')
+            state_watcher.check(lxc_storage[lxc_win.value])
             del sb
 
         elif key == 115:
@@ -909,12 +3737,9 @@ def keyboard_shortcuts(scr_id):
                     write_config('lxc.network.%s.%s' % (if_prop[0], np), if_prop[index])
 
         elif key == 108:
-            clone_name = ask_string(" Clone name ")
-            if clone_name:
-                clone = lxc_storage[lxc_win.value].clone(clone_name)
-                lxc_storage, lxc_list = get_all_lxc_list()
-                lxc_win.rlist.clear()
-                lxc_win.rlist.extend(lxc_list)
+            clone_data = clone_dialog(clone_methods(lxc_storage[lxc_win.value]))
+            if clone_data:
+                start_clones(lxc_storage[lxc_win.value], fan_out(clone_data[0], clone_data[1]), clone_data[2])
 
         elif key == 101:
             lxc_prop = edit_dialog()
@@ -930,10 +3755,13 @@ def keyboard_shortcuts(scr_id):
         elif key == 110:
             new_name = ask_string(' Rename ')
             if new_name:
+                old_name, config_path = lxc_storage[lxc_win.value].name, lxc_storage[lxc_win.value].get_config_path()
                 rename = lxc_storage[lxc_win.value].rename(new_name)
-                lxc_storage, lxc_list = get_all_lxc_list()
-                lxc_win.rlist.clear()
-                lxc_win.rlist.extend(lxc_list)
+                if rename:
+                    lxc_storage.remove(old_name, config_path)
+                    lxc_storage.add(new_name, config_path)
+                    lxc_storage.announce()
+                list_changed()
 
         elif key == 116:
             run_console(lxc_storage[lxc_win.value])
@@ -944,18 +3772,12 @@ def keyboard_shortcuts(scr_id):
                            curses.color_pair(3) | curses.A_BLINK, 'WAIT')
                 curses.panel.update_panels()
                 lxc_storage[lxc_win.value].wait("FROZEN", 3)
-                lxc_list[lxc_win.value] = lxc_list[lxc_win.value].replace('[R]', '[F]')
+                state_watcher.check(lxc_storage[lxc_win.value])
                 del sb
 
         elif key == 32:
-            lxc_storage[lxc_win.value].fork_size_calc(lxc_win.win_id, lxc_win.cursor_pos)
-            lxc_list = ['[%s] %-8s %-50s %s' % ('R' if fu.init_pid > 0 else 'S',
-                                            fu.get_rootfs_size(),
-                                            fu.name,
-                                            get_release_info(str(fu.config_file_name).replace('config', 'rootfs/etc/')))
-                        for fu in lxc_storage]
-            lxc_win.rlist.clear()
-            lxc_win.rlist.extend(lxc_list)
+            if lxc_storage:
+                lxc_storage[lxc_win.value].fork_size_calc()
 
         elif key == 117:
             if lxc_storage[lxc_win.value].running:
@@ -963,14 +3785,66 @@ def keyboard_shortcuts(scr_id):
                 sb = StatusBar(5, int(size_x / 2) - 50, 7, 3, curses.color_pair(3),
                            curses.color_pair(3) | curses.A_BLINK, 'WAIT')
                 curses.panel.update_panels()
-                lxc_storage[lxc_win.value].wait("FROZEN", 3)
-                lxc_list[lxc_win.value] = lxc_list[lxc_win.value].replace('[F]', '[R]')
+                lxc_storage[lxc_win.value].wait("RUNNING", 3)
+                state_watcher.check(lxc_storage[lxc_win.value])
                 del sb
 
 
 def main():
+    parser = argparse.ArgumentParser(description='User interface for managing linux containers')
+    parser.add_argument('--lxcpath', action='append', metavar='PATH',
+                        help='list containers of this lxcpath, may be repeated (default: the lxc.lxcpath of liblxc)')
+    parser.add_argument('--lxcpath-timeout', type=float, metavar='SECONDS',
+                        help='skip lxcpaths not listed within this time in --list and --boot, '
+                             'the interface and --daemon stop waiting for them after it (default: 10)')
+    parser.add_argument('--boot', action='store_true',
+                        help='start autostart containers by lxc.start.order and lxc.start.delay, then exit')
+    parser.add_argument('--boot-group', action='append', metavar='GROUP',
+                        help='boot containers of this lxc.group, "" for containers without one (default)')
+    parser.add_argument('--boot-wait-network', action='store_true',
+                        help='wait until started containers have an address before the next tier')
+    parser.add_argument('--boot-timeout', type=int, default=30, metavar='SECONDS')
+    parser.add_argument('--list', action='store_true', help='print the containers without starting the interface')
+    parser.add_argument('--json', action='store_true', help='print --list records as JSON lines')
+    parser.add_argument('--fields', default=','.join(LIST_DEFAULT_FIELDS),
+                        help='comma separated --list columns out of %s' % ','.join(LIST_FIELDS))
+    parser.add_argument('--daemon', action='store_true',
+                        help='serve the inventory of the lxcpaths to other instances over --socket')
+    parser.add_argument('--connect', action='store_true',
+                        help='take the inventory from the daemon listening on --socket')
+    parser.add_argument('--socket', default=DAEMON_SOCKET, metavar='PATH')
+    parser.add_argument('--profile-log', metavar='FILE',
+                        help='append the time, operation and milliseconds of every measured event to FILE')
+    args = parser.parse_args()
+    if args.profile_log:
+        profiler.open_log(args.profile_log)
+    if args.daemon:
+        InventoryDaemon(args.socket, args.lxcpath, listing_timeout=args.lxcpath_timeout or 10.0).serve()
+        return
+    inventory = None
+    if args.connect:
+        try:
+            inventory = use_daemon(args.socket)
+        except OSError as e:
+            parser.exit(1, '%s: %s\n' % (args.socket, e.strerror))
+    if args.list:
+        fields = [field for field in args.fields.split(',') if field]
+        unknown = [field for field in fields if field not in LIST_FIELDS]
+        if unknown or not fields:
+            parser.error('unknown fields: %s' % ','.join(unknown))
+        signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+        if inventory:
+            list_remote(inventory, fields, args.json)
+            return
+        size_scanner.max_jobs = max(2, os.cpu_count() or 1)
+        list_inventory(list_all_containers(args.lxcpath, args.lxcpath_timeout), fields, args.json)
+        return
+    if args.boot:
+        boot_host(boot_plan(list_all_containers(args.lxcpath, args.lxcpath_timeout), args.boot_group),
+                  wait_network=args.boot_wait_network, timeout=args.boot_timeout)
+        return
     main_scr = init_curses()
-    keyboard_shortcuts(main_scr)
+    keyboard_shortcuts(main_scr, args.lxcpath, inventory=inventory, listing_timeout=args.lxcpath_timeout or 10.0)
 
 
 if __name__ == '__main__':